@@ -1,128 +1,387 @@
+import argparse
+import os
+from contextlib import ExitStack
+from itertools import combinations
+from multiprocessing import Pool, cpu_count
 from astropy.io import fits
+from astropy.table import Table
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 import statsmodels.api as sm
 
 # Function to read the required columns from a FITS file
 def read_columns(file_name, columns):
+    """
+    Read the median and 68% interval of some parameters from a Beagle summary catalogue.
+
+    All the requested columns are read as arrays, in a single pass over the extensions
+    of the file. Returns, for each parameter, a dictionary with the 'ID' of the objects
+    in the extension where the parameter was found, and the 'median', 'low' and 'up'
+    arrays.
+    """
     result = {}
-    with fits.open(file_name) as hdul:
-        for col in columns:
-            found_column = False
-            for hdu in hdul:
-                if hdu.data is not None and isinstance(hdu.data, fits.FITS_rec):
-                    col_names = hdu.columns.names
-                    if col + '_median' in col_names:
-                        for row in hdu.data:
-                            id = row[col_names.index('ID')]
-                            if id not in result:
-                                result[id] = {}
-                            row_result = {'median': row[col_names.index(col + '_median')]}
-                            if col + '_68.00_low' in col_names and col + '_68.00_up' in col_names:
-                                row_result['low'] = row[col_names.index(col + '_68.00_low')]
-                                row_result['up'] = row[col_names.index(col + '_68.00_up')]
-                            elif col + '_68.00' in col_names:
-                                row_result['low'], row_result['up'] = row[col_names.index(col + '_68.00')]
-                            else:
-                                raise KeyError(f"Columns '{col}_68.00_low' and '{col}_68.00_up' not found in {file_name}.")
-                            result[id][col] = row_result
-                        found_column = True
-                        break
-            if not found_column:
-                raise KeyError(f"Column '{col}' not found in any extension of {file_name}.")
-        return result
-
-def read_column(file_name, column_name):
-    values = []
-    with fits.open(file_name) as hdul:
+    with fits.open(file_name, memmap=True) as hdul:
+        for hdu in hdul:
+            if hdu.data is None or not isinstance(hdu.data, fits.FITS_rec):
+                continue
+            col_names = hdu.columns.names
+            ids = None
+            for col in columns:
+                if col in result or col + '_median' not in col_names:
+                    continue
+                if ids is None:
+                    ids = np.array(hdu.data['ID'])
+                col_result = {'ID': ids, 'median': np.array(hdu.data[col + '_median'])}
+                if col + '_68.00_low' in col_names and col + '_68.00_up' in col_names:
+                    col_result['low'] = np.array(hdu.data[col + '_68.00_low'])
+                    col_result['up'] = np.array(hdu.data[col + '_68.00_up'])
+                elif col + '_68.00' in col_names:
+                    interval = np.array(hdu.data[col + '_68.00'])
+                    col_result['low'], col_result['up'] = interval[:, 0], interval[:, 1]
+                else:
+                    raise KeyError(f"Columns '{col}_68.00_low' and '{col}_68.00_up' not found in {file_name}.")
+                result[col] = col_result
+    for col in columns:
+        if col not in result:
+            raise KeyError(f"Column '{col}' not found in any extension of {file_name}.")
+    return result
+
+def match_ids(ids1, ids2):
+    """
+    Join two catalogues on their IDs.
+
+    Returns the indices of the objects common to both catalogues in each of them, in
+    the order of the first catalogue.
+    """
+    _, idx1, idx2 = np.intersect1d(ids1, ids2, return_indices=True)
+    order = np.argsort(idx1)
+    return idx1[order], idx2[order]
+
+def read_column(file_name, *column_names):
+    """
+    Read one or more columns, as arrays, from the first extension of a FITS file that
+    contains all of them. Only these columns are read from the (memory-mapped) file.
+    """
+    with fits.open(file_name, memmap=True) as hdul:
         for hdu in hdul:
             if hdu.data is not None and isinstance(hdu.data, fits.FITS_rec):
                 col_names = hdu.columns.names
-                if column_name in col_names:
-                    values.extend(hdu.data[column_name])
-                    break
-    return values
+                if all(name in col_names for name in column_names):
+                    values = [np.array(hdu.data[name]) for name in column_names]
+                    return values[0] if len(values) == 1 else values
+    raise KeyError(f"Columns {', '.join(column_names)} not found in any extension of {file_name}.")
 
-# Function to plot the data
-import numpy as np
+def load_columns(file_names, columns, cache=None):
+    """
+    Read some parameters from several Beagle summary catalogues.
+
+    The columns are kept in `cache` (a dictionary keyed by file name, shared across
+    calls), so that each column of each file is only read once.
+    """
+    if cache is None:
+        cache = {}
+    for file_name in file_names:
+        data = cache.setdefault(file_name, {})
+        missing = [col for col in columns if col not in data]
+        if missing:
+            data.update(read_columns(file_name, missing))
+    return cache
+
+def matched_values(data1, data2, log=False):
+    """
+    Join the values of a parameter read from two catalogues.
+
+    Returns the medians and the (low, up) errors of the objects common to both
+    catalogues, in log10 if `log` is set.
+    """
+    idx1, idx2 = match_ids(data1['ID'], data2['ID'])
+    x = data1['median'][idx1]
+    y = data2['median'][idx2]
+    x_low = data1['low'][idx1]
+    x_up = data1['up'][idx1]
+    y_low = data2['low'][idx2]
+    y_up = data2['up'][idx2]
+
+    # Apply log transformation if required
+    if log:
+        xerr = [(x - x_low) / (np.log(10) * x), (x_up - x) / (np.log(10) * x)]
+        yerr = [(y - y_low) / (np.log(10) * y), (y_up - y) / (np.log(10) * y)]
+        x = np.log10(x)
+        y = np.log10(y)
+    else:
+        xerr = [x - x_low, x_up - x]
+        yerr = [y - y_low, y_up - y]
+
+    return x, y, xerr, yerr
+
+def robust_fit(x, y):
+    """
+    Robust (Huber) linear regression of y on x, returning the intercept and slope.
+    """
+    X = sm.add_constant(x)  # Adds a constant term to the predictor
+    model = sm.RLM(y, X)
+    results = model.fit()
+    return results.params[0], results.params[1]
+
+# Tuning constant of the Huber norm, as in statsmodels' HuberT
+HUBER_T = 1.345
+
+def _batched_huber_fit(x, y, maxiter=50, tol=1e-8):
+    """
+    Robust (Huber) linear regression of each row of y on the same row of x.
+
+    This is the iteratively reweighted least squares of `sm.RLM` (Huber norm, scale
+    re-estimated at each iteration from the MAD of the residuals), run at once on a
+    batch of samples of shape (n_samples, n_objects). Returns the intercepts and slopes.
+    """
+    weights = np.ones_like(x)
+    intercept = slope = np.zeros(len(x))
+    for _ in range(maxiter):
+        sw = weights.sum(axis=1)
+        swx = (weights * x).sum(axis=1)
+        swy = (weights * y).sum(axis=1)
+        swxx = (weights * x * x).sum(axis=1)
+        swxy = (weights * x * y).sum(axis=1)
+
+        new_slope = (sw * swxy - swx * swy) / (sw * swxx - swx**2)
+        new_intercept = (swy - new_slope * swx) / sw
+
+        # Stop when the parameters of all the samples are stable
+        converged = all(np.all(np.abs(new - old) <= tol * np.maximum(np.abs(new), 1))
+                        for new, old in ((new_intercept, intercept), (new_slope, slope)))
+        intercept, slope = new_intercept, new_slope
+        if converged:
+            break
+
+        resid = y - intercept[:, None] - slope[:, None] * x
+        scale = np.median(np.abs(resid), axis=1) / 0.6744897501960817
+        scaled = np.abs(resid) / scale[:, None]
+        weights = np.where(scaled <= HUBER_T, 1.0, HUBER_T / np.maximum(scaled, HUBER_T))
+
+    return intercept, slope
+
+def _bootstrap_chunk(task):
+    """
+    Robust regressions of a chunk of bootstrap resamples, in a worker process.
+    """
+    x, y, yerr, n_resamples, seed = task
+    rng = np.random.default_rng(seed)
+
+    # Resample the objects with replacement, all the resamples of the chunk at once
+    idx = rng.integers(0, len(x), size=(n_resamples, len(x)))
+    x_b, y_b = x[idx], y[idx]
+
+    # Perturb the y values within their 68% errors, symmetrised so that the noise has
+    # zero mean and median and does not shift the fit. x is left unperturbed, as noise
+    # in x would dilute the slope towards zero.
+    if yerr is not None:
+        y_b += rng.standard_normal(idx.shape) * (0.5 * (yerr[0] + yerr[1]))[idx]
+
+    return _batched_huber_fit(x_b, y_b)
+
+def bootstrap_robust_fit(x, y, yerr=None, n_resamples=1000, interval=68.0, seed=None,
+                         num_cores=1, chunk_size=100):
+    """
+    Bootstrap percentile intervals on the intercept and slope of the robust regression.
+
+    The (x, y) pairs are resampled with replacement and, if the (low, up) errors on y
+    are given, the y values are also perturbed within their (symmetrised) 68% errors.
+    The resamples are fitted in chunks of `chunk_size` with a batched Huber regression,
+    spread over `num_cores` processes. Returns the lower and upper bounds of the central `interval`
+    (in percent) of the intercepts and slopes.
+    """
+    chunks = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(x, y, yerr, n, s) for n, s in zip(chunks, seeds)]
+
+    if num_cores > 1 and len(tasks) > 1:
+        with Pool(min(num_cores, len(tasks))) as pool:
+            results = pool.map(_bootstrap_chunk, tasks)
+    else:
+        results = [_bootstrap_chunk(task) for task in tasks]
+
+    intercepts = np.concatenate([intercept for intercept, _ in results])
+    slopes = np.concatenate([slope for _, slope in results])
+
+    percentiles = [50 - interval / 2, 50 + interval / 2]
+    intercept_low, intercept_up = np.nanpercentile(intercepts, percentiles)
+    slope_low, slope_up = np.nanpercentile(slopes, percentiles)
+
+    return {
+        'intercept_low': intercept_low,
+        'intercept_up': intercept_up,
+        'slope_low': slope_low,
+        'slope_up': slope_up,
+    }
+
+def comparison_statistics(x, y, yerr=None, outlier_threshold=3.0, n_bootstrap=0, interval=68.0,
+                          seed=None, num_cores=1):
+    """
+    Statistics of the comparison of the values of a parameter in two catalogues.
+
+    The offset is the median of y - x, the scatter its normalised median absolute
+    deviation, and outliers are the objects further than `outlier_threshold` times the
+    scatter from the offset. The slope and intercept are those of the robust regression
+    of y on x. If `n_bootstrap` is set, their bootstrap percentile intervals (see
+    `bootstrap_robust_fit`) are also computed, folding in the (low, up) errors on y if
+    given.
+    """
+    finite = np.isfinite(x) & np.isfinite(y)
+    if yerr is not None:
+        yerr = [np.abs(err[finite]) for err in yerr]
+        finite_errors = np.isfinite(yerr[0]) & np.isfinite(yerr[1])
+        yerr = [np.where(finite_errors, err, 0) for err in yerr]
+    x, y = x[finite], y[finite]
+    diff = y - x
+
+    offset = np.median(diff)
+    scatter = 1.4826 * np.median(np.abs(diff - offset))
+    intercept, slope = robust_fit(x, y)
+
+    stats = {
+        'n_objects': len(x),
+        'offset': offset,
+        'scatter': scatter,
+        'slope': slope,
+        'intercept': intercept,
+        'outlier_fraction': np.mean(np.abs(diff - offset) > outlier_threshold * scatter),
+    }
+
+    if n_bootstrap:
+        stats.update(bootstrap_robust_fit(x, y, yerr, n_bootstrap, interval, seed, num_cores))
+
+    return stats
+
+def plot_comparison(x, y, xerr, yerr, col, stats, label1="", label2="", log_label="", alpha=0.6,
+                    rasterized=False):
+    """
+    Plot the values of a parameter in two catalogues against each other, with the
+    robust regression line and the one-to-one line. Returns the figure.
+
+    If `rasterized` is set, the (dense) points and errorbars are rasterized when the
+    figure is saved to a vector format, while the rest of the figure stays vectorial.
+    """
+    fig, ax = plt.subplots()
+
+    ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='o', label=col, alpha=alpha, rasterized=rasterized)
+
+    # Plot the regression line
+    ax.plot(x, stats['intercept'] + stats['slope'] * x, 'r-', label='Robust Regression Line')
+
+    # Print the coefficients of the regressed line on the plot, with their bootstrap
+    # intervals if any
+    text = f"y = {stats['slope']:.2f}x + {stats['intercept']:.2f}"
+    if 'slope_low' in stats:
+        text += (f"\nslope in [{stats['slope_low']:.2f}, {stats['slope_up']:.2f}], "
+                 f"intercept in [{stats['intercept_low']:.2f}, {stats['intercept_up']:.2f}]")
+    ax.text(0.05, 0.95, text, transform=ax.transAxes, verticalalignment='top')
+
+    # Determine the common range for both axes
+    common_min = min(np.nanmin(x), np.nanmin(y))
+    common_max = max(np.nanmax(x), np.nanmax(y))
+
+    # Calculate 5% of the range
+    extension = 0.05 * (common_max - common_min)
+
+    # Extend the limits by the calculated amount
+    ax.set_xlim(common_min - extension, common_max + extension)
+    ax.set_ylim(common_min - extension, common_max + extension)
+
+    # Plot the diagonal line
+    ax.plot([common_min, common_max], [common_min, common_max], 'k--')
 
+    ax.set_xlabel(f'{log_label} {col} in {label1}')
+    ax.set_ylabel(f'{log_label} {col} in {label2}')
+    ax.legend()
+
+    return fig
+
+def _use_agg():
+    # Render off-screen in the pool workers, whatever their start method
+    matplotlib.use("Agg")
+
+def _render_comparison(task):
+    """
+    Render the plot of a comparison to a file, in a worker process. Returns the figure
+    if it has to be collected in a multi-page PDF, else None. The figure is closed
+    either way, so that the workers do not accumulate open figures.
+    """
+    file_name, keep_figure, args = task
+    fig = plot_comparison(*args)
+    fig.savefig(file_name, format=os.path.splitext(file_name)[1][1:] or 'pdf')
+    plt.close(fig)
+    if keep_figure:
+        return fig
+
+def compare_catalogues(file_names, labels, columns, log_columns=[], alpha=0.6,
+                       output_folder=".", statistics_file="comparison_statistics.csv", cache=None,
+                       num_cores=1, pdf_file=None, plot_format="pdf", rasterized=True, n_bootstrap=0,
+                       interval=68.0, seed=None, bootstrap_errors=False):
+    """
+    Compare some parameters across N Beagle summary catalogues.
+
+    Each column of each catalogue is read once (in the shared `cache`), then every pair
+    of catalogues is joined on ID and compared parameter by parameter. A plot is saved
+    for each pair and parameter, rendered in `num_cores` parallel processes, and the
+    statistics of all the comparisons (see `comparison_statistics`) are written to
+    `statistics_file` in the output folder. If `pdf_file` is given, all the plots are
+    also collected, in order, in this multi-page PDF. If `n_bootstrap` is set, the
+    statistics include bootstrap intervals on the robust regression, which also fold in
+    the errors of the second catalogue if `bootstrap_errors` is set. Returns the
+    statistics table.
+    """
+    cache = load_columns(file_names, columns, cache)
+
+    rows = []
+    tasks = []
+    for i, j in combinations(range(len(file_names)), 2):
+        for col in columns:
+            log = col in log_columns
+            x, y, xerr, yerr = matched_values(cache[file_names[i]][col], cache[file_names[j]][col], log)
+            stats = comparison_statistics(x, y, yerr if bootstrap_errors else None, n_bootstrap=n_bootstrap,
+                                          interval=interval, seed=seed, num_cores=num_cores)
+            rows.append({'parameter': col, 'log': log, 'catalogue_1': labels[i], 'catalogue_2': labels[j], **stats})
+
+            plot_file = os.path.join(output_folder, f'{col}_{labels[i]}_vs_{labels[j]}.{plot_format}')
+            tasks.append((plot_file, pdf_file is not None,
+                          (x, y, xerr, yerr, col, stats, labels[i], labels[j], "log10" if log else "", alpha,
+                           rasterized)))
+
+    table = Table(rows=rows)
+    table.write(os.path.join(output_folder, statistics_file), overwrite=True)
+
+    # Render one figure per comparison, in parallel, and collect them in order in the
+    # multi-page PDF as they come
+    with ExitStack() as stack:
+        if pdf_file is not None:
+            pdf = stack.enter_context(PdfPages(os.path.join(output_folder, pdf_file)))
+        if num_cores > 1 and len(tasks) > 1:
+            pool = stack.enter_context(Pool(min(num_cores, len(tasks)), initializer=_use_agg))
+            figures = pool.imap(_render_comparison, tasks)
+        else:
+            figures = map(_render_comparison, tasks)
+        for fig in figures:
+            if fig is not None:
+                pdf.savefig(fig)
+
+    return table
+
+# Function to plot the data
 def plot_columns(file1, file2, columns, label1="", label2="", log_columns=[], alpha=0.6):
-    data1 = read_columns(file1, columns)
-    data2 = read_columns(file2, columns)
+    cache = load_columns([file1, file2], columns)
     
     for col in columns:
-        x, y, xerr_low, xerr_up, yerr_low, yerr_up = [], [], [], [], [], []
-        log_label = ""
-        
-        for id, values in data1.items():
-            if id in data2:
-                x_val = values[col]['median']
-                y_val = data2[id][col]['median']
-                x_low = values[col]['low']
-                x_up = values[col]['up']
-                y_low = data2[id][col]['low']
-                y_up = data2[id][col]['up']
-
-                # Apply log transformation if the column is in log_columns
-                if col in log_columns:
-                    log_label = "log10"
-                    x_err_low = (x_val - x_low) / (np.log(10) * x_val)
-                    x_err_up = (x_up - x_val) / (np.log(10) * x_val)
-                    y_err_low = (y_val - y_low) / (np.log(10) * y_val)
-                    y_err_up = (y_up - y_val) / (np.log(10) * y_val)
-                    x_val = np.log10(x_val)
-                    y_val = np.log10(y_val)
-                else:
-                    x_err_low = x_val - x_low
-                    x_err_up = x_up - x_val
-                    y_err_low = y_val - y_low
-                    y_err_up = y_up - y_val
-
-                x.append(x_val)
-                y.append(y_val)
-                xerr_low.append(x_err_low)
-                xerr_up.append(x_err_up)
-                yerr_low.append(y_err_low)
-                yerr_up.append(y_err_up)
-        
-        xerr = [np.array(xerr_low), np.array(xerr_up)]
-        yerr = [np.array(yerr_low), np.array(yerr_up)]
-        
-        plt.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='o', label=col, alpha=alpha)
-
-        # Robust linear regression
-        X = sm.add_constant(x)  # Adds a constant term to the predictor
-        model = sm.RLM(y, X)
-        results = model.fit()
-
-        # Plot the regression line
-        plt.plot(x, results.fittedvalues, 'r-', label='Robust Regression Line')
-
-        # Print the coefficients of the regressed line on the plot
-        plt.text(0.05, 0.95, f'y = {results.params[1]:.2f}x + {results.params[0]:.2f}', 
-                 transform=plt.gca().transAxes, verticalalignment='top')
-        
-        # Determine the common range for both axes
-        common_min = min(min(x), min(y))
-        common_max = max(max(x), max(y))
-
-        # Calculate 5% of the range
-        extension = 0.05 * (common_max - common_min)
-        
-        # Extend the limits by the calculated amount
-        plt.xlim(common_min - extension, common_max + extension)
-        plt.ylim(common_min - extension, common_max + extension)
-        
-        # Plot the diagonal line
-        plt.plot([common_min, common_max], [common_min, common_max], 'k--')
-        
-        plt.xlabel(f'{log_label} {col} in {label1}')
-        plt.ylabel(f'{log_label} {col} in {label2}')
-        plt.legend()
-        plt.savefig(f'{col}_plot.pdf', format='pdf')
+        log_label = "log10" if col in log_columns else ""
+        x, y, xerr, yerr = matched_values(cache[file1][col], cache[file2][col], col in log_columns)
+        stats = comparison_statistics(x, y)
+
+        fig = plot_comparison(x, y, xerr, yerr, col, stats, label1, label2, log_label, alpha)
+        fig.savefig(f'{col}_plot.pdf', format='pdf')
         plt.show()
 
-from scipy.stats import chi2
+from scipy.stats import chi2, kstest
 
 def plot_chi_square(file_name, chi_square_column, degrees_of_freedom, bins=1500, label=""):
     # Read chi-square values from file1
@@ -146,24 +405,274 @@ def plot_chi_square(file_name, chi_square_column, degrees_of_freedom, bins=1500,
     plt.savefig(f'chi_square_plot{label}.pdf', format='pdf')
     plt.show()
 
-# List of columns to plot
-columns_to_plot = ["M_tot", "SFR", "logOH", "tauv_eff", "nebular_logu", "nebular_xi", "mass_w_age"]
-log_columns=["M_tot", "SFR",  "mass_w_age", "tauv_eff"]
+def chi_square_diagnostics(file_name, chi_square_column="MAP_chi_square", n_data_column="MAP_n_data", n_params=0):
+    """
+    Goodness of fit of each object of a Beagle summary catalogue.
+
+    Only the chi-square and number of data points columns are read. Each object has
+    its own number of degrees of freedom (the number of data points minus `n_params`).
+    Returns the chi-square, degrees of freedom, reduced chi-square and p-value of each
+    object.
+    """
+    chi_square, n_data = read_column(file_name, chi_square_column, n_data_column)
+    return _chi_square_statistics(chi_square, n_data, n_params)
+
+def _chi_square_statistics(chi_square, n_data, n_params=0):
+    dof = n_data - n_params
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reduced_chi_square = chi_square / dof
+    p_value = chi2.sf(chi_square, dof)
+    return chi_square, dof, reduced_chi_square, p_value
+
+def chi_square_summary(reduced_chi_square, p_value, threshold=0.05):
+    """
+    Summary of the goodness of fit of the objects of a catalogue: the median and 68%
+    range of the reduced chi-square, the fraction of bad fits (p-value below
+    `threshold`), and the Kolmogorov-Smirnov test of the uniformity of the p-values.
+    """
+    finite = np.isfinite(reduced_chi_square) & np.isfinite(p_value)
+    reduced_chi_square, p_value = reduced_chi_square[finite], p_value[finite]
+    low, median, up = np.percentile(reduced_chi_square, [16, 50, 84])
+    ks = kstest(p_value, 'uniform')
+    return {
+        'n_objects': len(p_value),
+        'reduced_chi_square_median': median,
+        'reduced_chi_square_low': low,
+        'reduced_chi_square_up': up,
+        'bad_fit_fraction': np.mean(p_value <= threshold),
+        'ks_statistic': ks.statistic,
+        'ks_p_value': ks.pvalue,
+    }
+
+def plot_p_values(p_values, labels):
+    """
+    PP-plot of the p-values of the fits of several catalogues: the empirical
+    cumulative distribution of the p-values against the uniform one expected for
+    correctly estimated errors. Returns the figure.
+    """
+    fig, ax = plt.subplots()
+
+    for p_value, label in zip(p_values, labels):
+        p_value = np.sort(p_value[np.isfinite(p_value)])
+        expected = (np.arange(len(p_value)) + 0.5) / len(p_value)
+        ax.plot(expected, p_value, '-', label=label, rasterized=True)
+
+    ax.plot([0, 1], [0, 1], 'k--')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_xlabel('Expected cumulative probability (uniform p-values)')
+    ax.set_ylabel('Observed p-value')
+    ax.legend()
+
+    return fig
+
+def chi_square_report(file_names, labels, output_folder=".", summary_file="chi_square_summary.csv",
+                      plot_file="chi_square_pp_plot.pdf", n_params=0, threshold=0.05,
+                      chi_square_column="MAP_chi_square", n_data_column="MAP_n_data"):
+    """
+    Chi-square goodness-of-fit diagnostics for several Beagle summary catalogues.
+
+    Writes a table with the reduced chi-square and p-value of each object of each
+    catalogue, a summary table with one row per catalogue (see `chi_square_summary`),
+    and a PP-plot of the p-values of all the catalogues. Returns the summary table.
+    """
+    rows = []
+    p_values = []
+    for file_name, label in zip(file_names, labels):
+        # The IDs are read from the same extension as the fit columns, so that the rows are aligned
+        ids, chi_square, n_data = read_column(file_name, 'ID', chi_square_column, n_data_column)
+        chi_square, dof, reduced_chi_square, p_value = _chi_square_statistics(chi_square, n_data, n_params)
+        Table({'ID': ids, 'chi_square': chi_square, 'dof': dof, 'reduced_chi_square': reduced_chi_square,
+               'p_value': p_value}).write(os.path.join(output_folder, f'chi_square_{label}.csv'), overwrite=True)
+        rows.append({'catalogue': label, **chi_square_summary(reduced_chi_square, p_value, threshold)})
+        p_values.append(p_value)
+
+    table = Table(rows=rows)
+    table.write(os.path.join(output_folder, summary_file), overwrite=True)
+
+    fig = plot_p_values(p_values, labels)
+    fig.savefig(os.path.join(output_folder, plot_file))
+    plt.close(fig)
+
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the parameters of several Beagle summary catalogues.")
+
+    parser.add_argument(
+        '--catalogues',
+        help="Beagle summary catalogues to compare",
+        action="store",
+        type=str,
+        nargs="+",
+        dest="catalogues",
+        required=True
+    )
+
+    parser.add_argument(
+        '--labels',
+        help="Labels of the catalogues (default: the catalogue file names)",
+        action="store",
+        type=str,
+        nargs="+",
+        dest="labels",
+        default=None
+    )
+
+    parser.add_argument(
+        '--columns',
+        help="Parameters to compare",
+        action="store",
+        type=str,
+        nargs="+",
+        dest="columns",
+        default=["M_tot", "SFR", "logOH", "tauv_eff", "nebular_logu", "nebular_xi", "mass_w_age"]
+    )
+
+    parser.add_argument(
+        '--log-columns',
+        help="Parameters compared in log10",
+        action="store",
+        type=str,
+        nargs="*",
+        dest="log_columns",
+        default=["M_tot", "SFR", "mass_w_age", "tauv_eff"]
+    )
+
+    parser.add_argument(
+        '--output-folder',
+        help="Folder where the plots and statistics are written",
+        action="store",
+        type=str,
+        dest="output_folder",
+        default="."
+    )
+
+    parser.add_argument(
+        '--statistics',
+        help="Name of the table of comparison statistics (the format follows the extension)",
+        action="store",
+        type=str,
+        dest="statistics_file",
+        default="comparison_statistics.csv"
+    )
+
+    parser.add_argument(
+        '--pdf',
+        help="Also collect all the plots in this multi-page PDF",
+        action="store",
+        type=str,
+        dest="pdf_file",
+        default=None
+    )
+
+    parser.add_argument(
+        '--plot-format',
+        help="Format of the individual plots",
+        action="store",
+        type=str,
+        dest="plot_format",
+        default="pdf"
+    )
+
+    parser.add_argument(
+        '--alpha',
+        help="Transparency of the points",
+        action="store",
+        type=float,
+        dest="alpha",
+        default=0.6
+    )
+
+    parser.add_argument(
+        '--bootstrap',
+        help="Number of bootstrap resamples used to estimate the uncertainty of the robust regression (0 to disable)",
+        action="store",
+        type=int,
+        dest="n_bootstrap",
+        default=0
+    )
+
+    parser.add_argument(
+        '--bootstrap-interval',
+        help="Central percentile interval of the bootstrap (in percent)",
+        action="store",
+        type=float,
+        dest="interval",
+        default=68.0
+    )
+
+    parser.add_argument(
+        '--bootstrap-errors',
+        help="Also perturb the values of the second catalogue within their 68%% errors in the bootstrap",
+        action="store_true",
+        dest="bootstrap_errors",
+        default=False
+    )
+
+    parser.add_argument(
+        '--seed',
+        help="Seed of the bootstrap resampling",
+        action="store",
+        type=int,
+        dest="seed",
+        default=None
+    )
+
+    parser.add_argument(
+        '--chi-square',
+        help="Only compute the chi-square goodness-of-fit diagnostics of each catalogue",
+        action="store_true",
+        dest="chi_square",
+        default=False
+    )
+
+    parser.add_argument(
+        '--n-params',
+        help="Number of free parameters subtracted from the number of data points to get the degrees of freedom",
+        action="store",
+        type=int,
+        dest="n_params",
+        default=0
+    )
+
+    parser.add_argument(
+        '-np',
+        help="Number of parallel executions",
+        action="store",
+        type=int,
+        dest="num_cores",
+        default=None
+    )
+
+    args = parser.parse_args()
+
+    # Render the plots off-screen, e.g. on the cluster nodes
+    matplotlib.use("Agg")
+
+    if len(args.catalogues) < 2 and not args.chi_square:
+        parser.error("at least two catalogues are needed for a comparison")
+
+    labels = args.labels or [os.path.splitext(os.path.basename(f))[0] for f in args.catalogues]
+    if len(labels) != len(args.catalogues):
+        parser.error("the number of labels must match the number of catalogues")
 
-columns_to_plot = ["M_tot"]
-log_columns=["M_tot"]
+    os.makedirs(args.output_folder, exist_ok=True)
 
-# Path to the FITS files
-file_spec = '/Users/jchevall/JWST/JADES/results/DEEP_GOODS_S_R100_base_v3.0_mup100/pyp-beagle/data/BEAGLE_summary_catalogue.fits'
-file_photom_spec = '/Users/jchevall/JWST/JADES/results/fit_R100_photom_poly/pyp-beagle/data/BEAGLE_summary_catalogue_reformatted_R100_v3p0_photom_poly.fits'
+    if args.chi_square:
+        table = chi_square_report(args.catalogues, labels, output_folder=args.output_folder, n_params=args.n_params)
+        table.pprint(max_lines=-1, max_width=-1)
+        return
 
-label1 = "R100"
-label2 = "R100+photometry"
+    num_cores = cpu_count() if args.num_cores is None else args.num_cores
 
-dof = 683
-chi_sq_col = "MAP_chi_square"
-#plot_chi_square(file_photom_spec, chi_square_column=chi_sq_col, degrees_of_freedom=dof, label=label2)
+    table = compare_catalogues(args.catalogues, labels, args.columns, log_columns=args.log_columns,
+                               alpha=args.alpha, output_folder=args.output_folder,
+                               statistics_file=args.statistics_file, num_cores=num_cores,
+                               pdf_file=args.pdf_file, plot_format=args.plot_format,
+                               n_bootstrap=args.n_bootstrap, interval=args.interval, seed=args.seed,
+                               bootstrap_errors=args.bootstrap_errors)
+    table.pprint(max_lines=-1, max_width=-1)
 
-# Call the function to plot the data
-plot_columns(file_spec, file_photom_spec, columns_to_plot, 
-             label1=label1, label2=label2, log_columns=log_columns)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
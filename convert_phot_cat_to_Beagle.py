@@ -1,9 +1,12 @@
+import hashlib
+import logging
 import numpy as np
 import os
 from astropy.io import fits
-from astropy.io.fits.hdu.hdulist import HDUList
 from astropy.table import Table
+from scipy.spatial import cKDTree
 from collections import OrderedDict, defaultdict
+from multiprocessing import Pool
 import argparse
 from enum import Enum
 
@@ -25,6 +28,8 @@ class ColumnNames:
     RA = {extension: "FLAG", name: "RA"}
     DEC = {extension: "FLAG", name: "DEC"}
     ID = "ID"
+    MATCH_SEPARATION = "MATCH_SEPARATION"
+    MATCH_AMBIGUOUS = "MATCH_AMBIGUOUS"
 
 
 class PhotometryType:
@@ -38,13 +43,24 @@ class Tier:
     goods_s_suffix = "_gs"
     goods_s = "GOODS-S"
     goods_s_infix = "goodss."
+    goods_s_keyword = "PHOT_GS"
     goods_n_suffix = "_gn"
     goods_n = "GOODS-N"
     goods_n_infix = "goodsn."
+    goods_n_keyword = "PHOT_GN"
 
 
 FWHM_CUTOFF = 5.0
 
+# Sidecar file caching the columns read from a photometry catalogue
+COLUMN_CACHE_SUFFIX = ".columns.npz"
+
+
+class ColumnCacheKeys:
+    size = "__size__"
+    mtime = "__mtime__"
+    checksum = "__checksum__"
+
 
 class DefaultFilters:
     name = "name"
@@ -87,18 +103,359 @@ def get_tier(tier: str) -> str:
         raise ValueError(f"Cannot determine tier from {tier}")
 
 
-def get_value_from_multi_ext_fits(
-    cat: HDUList,
-    ext: str,
-    column: str,
-    ID: str | int | None = None,
-    ID_column: str = ColumnNames.ID,
-) -> float:
-    if ID is not None:
-        ID = int(ID)
-        return cat[ext].data[column][cat[ext].data[ID_column] == ID][0]
+def get_tiers(tiers: np.ndarray) -> np.ndarray:
+    """Vectorised version of `get_tier`, for a whole column of tiers."""
+    tiers = np.asarray(tiers, dtype=str)
+
+    is_goods_s = np.char.endswith(tiers, Tier.goods_s_suffix) | (
+        np.char.find(tiers, Tier.goods_s_suffix + "_") >= 0
+    )
+    is_goods_n = np.char.endswith(tiers, Tier.goods_n_suffix) | (
+        np.char.find(tiers, Tier.goods_n_suffix + "_") >= 0
+    )
+
+    unknown = ~(is_goods_s | is_goods_n)
+    if np.any(unknown):
+        raise ValueError(f"Cannot determine tier from {tiers[unknown][0]}")
+
+    return np.where(is_goods_s, Tier.goods_s, Tier.goods_n)
+
+
+def build_id_index(ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Build a sort-based index of an ID column.
+
+    Returns the sorted IDs and the row of each of them in the catalogue, to be used
+    with `lookup_rows`. Among repeated IDs, the first row is used.
+    """
+    order = np.argsort(ids, kind="stable")
+    return ids[order], order
+
+
+def lookup_rows(index: tuple[np.ndarray, np.ndarray], IDs: np.ndarray) -> np.ndarray:
+    """Find the catalogue rows of many IDs at once with a binary search on the index."""
+    sorted_ids, order = index
+    IDs = np.asarray(IDs)
+
+    if len(sorted_ids) == 0:
+        pos = np.zeros(len(IDs), dtype=int)
+        found = np.zeros(len(IDs), dtype=bool)
+    else:
+        pos = np.minimum(np.searchsorted(sorted_ids, IDs), len(sorted_ids) - 1)
+        found = sorted_ids[pos] == IDs
+
+    if not np.all(found):
+        raise ValueError(f"IDs not found in the photometry catalogue: {IDs[~found]}")
+
+    return order[pos]
+
+
+def projected_columns() -> dict[str, list[str]]:
+    """Columns of each extension of a photometry catalogue used in the conversion."""
+    columns = {
+        ColumnNames.FLAG: [ColumnNames.ID],
+        ColumnNames.SIZE[ColumnNames.extension]: [ColumnNames.ID],
+        PhotometryType.kron[PhotometryType.extension]: [],
+        PhotometryType.circ[PhotometryType.extension]: [],
+    }
+
+    for column in (ColumnNames.SIZE, ColumnNames.RA, ColumnNames.DEC):
+        columns.setdefault(column[ColumnNames.extension], []).append(
+            column[ColumnNames.name]
+        )
+
+    for filter in DefaultFilters.hst_jwst:
+        columns[ColumnNames.FLAG].append(
+            filter[DefaultFilters.name] + "_" + ColumnNames.FLAG
+        )
+        for phot_type in (PhotometryType.kron, PhotometryType.circ):
+            column = filter[DefaultFilters.name] + "_" + phot_type[PhotometryType.name]
+            columns[phot_type[PhotometryType.extension]] += [
+                column,
+                column + ColumnNames.error_suffix,
+            ]
+
+    return columns
+
+
+def _file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-1 checksum of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _cache_key(ext: str, column: str) -> str:
+    return f"{ext}.{column}"
+
+
+def _read_column_cache(
+    cache_file: str, catalogue: str, columns: dict[str, list[str]]
+) -> dict[str, dict[str, np.ndarray]] | None:
+    """Read the projected columns from the sidecar cache of a catalogue.
+
+    Returns None if there is no cache, if it lacks some of the columns or if the
+    catalogue changed since the cache was written. The catalogue is only read (to
+    compute its checksum) when its size or modification time differ from the ones
+    recorded in the cache. If the content did not change, the cache is stamped with
+    the new size and modification time, so that it is not checksummed again.
+    """
+    if not os.path.isfile(cache_file):
+        return None
+
+    stat = os.stat(catalogue)
+
+    with np.load(cache_file) as cache:
+        if any(
+            _cache_key(ext, column) not in cache.files
+            for ext, names in columns.items()
+            for column in names
+        ):
+            return None
+
+        restamp = (
+            cache[ColumnCacheKeys.size] != stat.st_size
+            or cache[ColumnCacheKeys.mtime] != stat.st_mtime_ns
+        )
+        if restamp and cache[ColumnCacheKeys.checksum] != _file_checksum(catalogue):
+            return None
+
+        if restamp:
+            arrays = {key: cache[key] for key in cache.files}
+            arrays[ColumnCacheKeys.size] = np.array(stat.st_size)
+            arrays[ColumnCacheKeys.mtime] = np.array(stat.st_mtime_ns)
+            _save_column_cache(cache_file, arrays)
+
+        return {
+            ext: {column: cache[_cache_key(ext, column)] for column in names}
+            for ext, names in columns.items()
+        }
+
+
+def _save_column_cache(cache_file: str, arrays: dict[str, np.ndarray]) -> None:
+    # Write to a temporary file first, so that an interrupted run cannot leave a
+    # truncated cache behind
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_file, cache_file)
+
+
+def _write_column_cache(
+    cache_file: str, catalogue: str, data: dict[str, dict[str, np.ndarray]]
+) -> None:
+    stat = os.stat(catalogue)
+
+    arrays = {
+        _cache_key(ext, column): values
+        for ext, columns in data.items()
+        for column, values in columns.items()
+    }
+    arrays[ColumnCacheKeys.size] = np.array(stat.st_size)
+    arrays[ColumnCacheKeys.mtime] = np.array(stat.st_mtime_ns)
+    arrays[ColumnCacheKeys.checksum] = np.array(_file_checksum(catalogue))
+
+    _save_column_cache(cache_file, arrays)
+
+
+def read_catalogue(
+    catalogue: str, cache: bool = False
+) -> dict[str, dict[str, np.ndarray]]:
+    """Read the columns of a photometry catalogue used in the conversion.
+
+    The catalogue is memory-mapped and only the projected columns (see
+    `projected_columns`) are materialised, as `{extension: {column: array}}`. If
+    `cache` is set, the columns are also cached in a `.npz` sidecar file next to the
+    catalogue, which is used in the following runs as long as the catalogue does not
+    change.
+    """
+    columns = projected_columns()
+    cache_file = remove_fits_ext(catalogue) + COLUMN_CACHE_SUFFIX
+
+    if cache:
+        data = _read_column_cache(cache_file, catalogue, columns)
+        if data is not None:
+            logging.info(f"Read the columns of {catalogue} from {cache_file}")
+            return data
+
+    with fits.open(catalogue, memmap=True, lazy_load_hdus=True) as hdul:
+        data = {
+            ext: {column: np.array(hdul[ext].data[column]) for column in names}
+            for ext, names in columns.items()
+        }
+
+    if cache:
+        try:
+            _write_column_cache(cache_file, catalogue, data)
+        except OSError as e:
+            logging.warning(f"Cannot write the column cache {cache_file}: {e}")
+
+    return data
+
+
+def extract_photometry(
+    cat: dict[str, dict[str, np.ndarray]], nircam_ids: np.ndarray
+) -> dict[str, np.ndarray]:
+    """Extract the size, position and photometry of many objects from a tier catalogue.
+
+    `cat` holds the columns of the catalogue, as returned by `read_catalogue`. Returns
+    the columns of the output catalogue, with one row for each of `nircam_ids`. The
+    photometry is taken from the CIRC apertures for compact objects (FWHM below
+    `FWHM_CUTOFF`) and from the KRON ones otherwise, and is set to -99 in the filters
+    where it is flagged or zero.
+    """
+    flag_data = cat[ColumnNames.FLAG]
+    size_data = cat[ColumnNames.SIZE[ColumnNames.extension]]
+
+    rows = lookup_rows(build_id_index(flag_data[ColumnNames.ID]), nircam_ids)
+    size_rows = lookup_rows(build_id_index(size_data[ColumnNames.ID]), nircam_ids)
+
+    size = size_data[ColumnNames.SIZE[ColumnNames.name]][size_rows]
+    ra = cat[ColumnNames.RA[ColumnNames.extension]][ColumnNames.RA[ColumnNames.name]]
+    dec = cat[ColumnNames.DEC[ColumnNames.extension]][ColumnNames.DEC[ColumnNames.name]]
+
+    columns = {
+        ColumnNames.RA[ColumnNames.name]: ra[rows],
+        ColumnNames.DEC[ColumnNames.name]: dec[rows],
+        ColumnNames.SIZE[ColumnNames.name]: size,
+    }
+
+    use_circ = size < FWHM_CUTOFF
+    circ_data = cat[PhotometryType.circ[PhotometryType.extension]]
+    kron_data = cat[PhotometryType.kron[PhotometryType.extension]]
+
+    for filter in DefaultFilters.hst_jwst:
+        circ_column = (
+            filter[DefaultFilters.name] + "_" + PhotometryType.circ[PhotometryType.name]
+        )
+        kron_column = (
+            filter[DefaultFilters.name] + "_" + PhotometryType.kron[PhotometryType.name]
+        )
+
+        flag = flag_data[filter[DefaultFilters.name] + "_" + ColumnNames.FLAG][rows]
+        phot_val = np.where(
+            use_circ, circ_data[circ_column][rows], kron_data[kron_column][rows]
+        )
+        phot_err = np.where(
+            use_circ,
+            circ_data[circ_column + ColumnNames.error_suffix][rows],
+            kron_data[kron_column + ColumnNames.error_suffix][rows],
+        )
+
+        good = (flag == 0) & (phot_val != 0)
+        columns[filter[DefaultFilters.label]] = np.where(good, phot_val, -99)
+        columns[filter[DefaultFilters.label] + "_" + DefaultFilters.err] = np.where(
+            good, phot_err, -99
+        )
+
+    return columns
+
+
+def _unit_vectors(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    return np.column_stack(
+        (np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec))
+    )
+
+
+def cross_match(
+    cat_ra: np.ndarray,
+    cat_dec: np.ndarray,
+    ra: np.ndarray,
+    dec: np.ndarray,
+    radius: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Match positions to the nearest catalogue source within `radius` arcsec.
+
+    A KD-tree is built on the unit vectors of the catalogue positions and all the
+    positions are matched in one query. Returns, for each position, the matched
+    catalogue row (-1 if there is no source within the radius), the separation in
+    arcsec (-99 if unmatched), and whether the match is ambiguous, i.e. a second
+    source also lies within the radius.
+    """
+    # Chord length on the unit sphere corresponding to the match radius
+    chord = 2 * np.sin(np.radians(radius / 3600.0) / 2)
+
+    # Catalogue sources without a valid position cannot be matched
+    valid = np.flatnonzero(np.isfinite(cat_ra) & np.isfinite(cat_dec))
+
+    tree = cKDTree(_unit_vectors(cat_ra[valid], cat_dec[valid]))
+    distances, rows = tree.query(
+        _unit_vectors(ra, dec), k=2, distance_upper_bound=chord
+    )
+
+    matched = np.isfinite(distances[:, 0])
+    best = np.full(len(ra), -1)
+    best[matched] = valid[rows[matched, 0]]
+    separation = np.full(len(ra), -99.0)
+    separation[matched] = np.degrees(2 * np.arcsin(distances[matched, 0] / 2)) * 3600
+
+    return (
+        best,
+        separation,
+        np.isfinite(distances[:, 1]),
+    )
+
+
+def _extract_tier_photometry(
+    catalogue: str,
+    nircam_ids: np.ndarray,
+    cache: bool = False,
+    ra: np.ndarray | None = None,
+    dec: np.ndarray | None = None,
+    match_radius: float | None = None,
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Extract the photometry of the objects of a tier from its catalogue.
+
+    Objects without a NIRCam ID (-1) are cross-matched by position if `match_radius`
+    is given. Returns which objects were found in the catalogue, and the output
+    columns of these objects.
+    """
+    cat = read_catalogue(catalogue, cache)
+
+    nircam_ids = nircam_ids.copy()
+    separation = np.full(len(nircam_ids), -99.0)
+    ambiguous = np.zeros(len(nircam_ids), dtype=bool)
+
+    if match_radius is not None:
+        unmatched = np.flatnonzero(
+            (nircam_ids < 0) & np.isfinite(ra) & np.isfinite(dec)
+        )
     else:
-        return cat[ext].data[column]
+        unmatched = np.array([], dtype=int)
+
+    if len(unmatched):
+        cat_ra = cat[ColumnNames.RA[ColumnNames.extension]][
+            ColumnNames.RA[ColumnNames.name]
+        ]
+        cat_dec = cat[ColumnNames.DEC[ColumnNames.extension]][
+            ColumnNames.DEC[ColumnNames.name]
+        ]
+        rows, match_separation, match_ambiguous = cross_match(
+            cat_ra,
+            cat_dec,
+            ra[unmatched],
+            dec[unmatched],
+            match_radius,
+        )
+        found = rows >= 0
+        nircam_ids[unmatched[found]] = cat[ColumnNames.FLAG][ColumnNames.ID][
+            rows[found]
+        ]
+        separation[unmatched] = match_separation
+        ambiguous[unmatched] = match_ambiguous
+
+    has_id = nircam_ids >= 0
+    columns = extract_photometry(cat, nircam_ids[has_id])
+    columns[ColumnNames.NIRCam_ID] = nircam_ids[has_id]
+
+    if match_radius is not None:
+        columns[ColumnNames.MATCH_SEPARATION] = separation[has_id]
+        columns[ColumnNames.MATCH_AMBIGUOUS] = ambiguous[has_id]
+
+    return has_id, columns
 
 
 def main():
@@ -142,11 +499,62 @@ def main():
         default=False,
     )
 
+    # Whether to cache the columns read from the photometry catalogues
+    parser.add_argument(
+        "--cache",
+        help="Cache the columns read from the photometry catalogues in a .npz file "
+        "next to them, to speed up the following runs",
+        action="store_true",
+        dest="cache",
+        default=False,
+    )
+
+    # Cross-match the objects without a NIRCam ID by position
+    parser.add_argument(
+        "--match-radius",
+        help="Cross-match the objects without a NIRCam ID to the nearest source of the "
+        "photometry catalogue within this radius (in arcsec)",
+        action="store",
+        type=float,
+        default=None,
+        dest="match_radius",
+    )
+
+    parser.add_argument(
+        "--ra-column",
+        help="Name of the RA column (in degrees) of the input catalogue, used in the "
+        "cross-match",
+        action="store",
+        type=str,
+        default=ColumnNames.RA[ColumnNames.name],
+        dest="ra_column",
+    )
+
+    parser.add_argument(
+        "--dec-column",
+        help="Name of the DEC column (in degrees) of the input catalogue, used in the "
+        "cross-match",
+        action="store",
+        type=str,
+        default=ColumnNames.DEC[ColumnNames.name],
+        dest="dec_column",
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="number of parallel processes used to process the tiers "
+        "(default: one per tier)",
+        action="store",
+        type=int,
+        default=None,
+        dest="workers",
+    )
+
     args = parser.parse_args()
 
     input_cat = Table.read(args.input_catalogue)
 
-    phot_cat = {}
+    catalogues = {Tier.goods_s: args.goods_s, Tier.goods_n: args.goods_n}
 
     # Columns in the output catalogue
     cols = {
@@ -165,111 +573,113 @@ def main():
         cols[filter] = float
         cols[filter + "_" + DefaultFilters.err] = float
 
+    if args.match_radius is not None:
+        cols[ColumnNames.MATCH_SEPARATION] = float
+        cols[ColumnNames.MATCH_AMBIGUOUS] = bool
+
     # Initialize all columns as numpy arrays of length equal to the number of rows in the input catalogue and filled with -99
     output_cat = {
         name: np.full(len(input_cat), -99, dtype=dtype) for name, dtype in cols.items()
     }
 
-    for i, obj in enumerate(input_cat):
-        nircam_id = obj[ColumnNames.NIRCam_ID]
-        nirspec_id = obj[ColumnNames.NIRSpec_ID]
+    output_cat[ColumnNames.NIRSpec_ID][:] = input_cat[ColumnNames.NIRSpec_ID]
 
-        output_cat[ColumnNames.NIRSpec_ID][i] = nirspec_id
+    if args.match_radius is not None:
+        output_cat[ColumnNames.MATCH_AMBIGUOUS][:] = False
 
-        if not nircam_id.strip():
-            continue
-        else:
-            nircam_id = int(nircam_id)
-
-        output_cat[ColumnNames.NIRCam_ID][i] = nircam_id
-
-        tier = get_tier(obj[ColumnNames.TIER])
-
-        if tier == Tier.goods_s and Tier.goods_s not in phot_cat:
-            if not args.goods_s:
-                raise ValueError("GOODS-S catalogue not provided")
-            phot_cat[Tier.goods_s] = fits.open(args.goods_s)
-        elif tier == Tier.goods_n and Tier.goods_n not in phot_cat:
-            if not args.goods_n:
-                raise ValueError("GOODS-N catalogue not provided")
-            phot_cat[Tier.goods_n] = fits.open(args.goods_n)
-
-        size = get_value_from_multi_ext_fits(
-            phot_cat[tier],
-            ColumnNames.SIZE[ColumnNames.extension],
-            ColumnNames.SIZE[ColumnNames.name],
-            nircam_id,
-        )
-        ra = get_value_from_multi_ext_fits(
-            phot_cat[tier],
-            ColumnNames.RA[ColumnNames.extension],
-            ColumnNames.RA[ColumnNames.name],
-            nircam_id,
+    # Objects without a NIRCam ID keep -99 everywhere, unless they are cross-matched
+    # by position
+    nircam_ids = np.char.strip(
+        np.asarray(np.ma.filled(input_cat[ColumnNames.NIRCam_ID], ""), dtype=str)
+    )
+    has_id = nircam_ids != ""
+    nircam_ids = np.where(has_id, nircam_ids, "-1").astype(int)
+
+    if args.match_radius is not None:
+        for column in (args.ra_column, args.dec_column):
+            if column not in input_cat.colnames:
+                raise ValueError(f"Column {column} not found in the input catalogue")
+        # Masked or non-finite coordinates are left unmatched
+        ra, dec = (
+            np.ma.filled(np.ma.asarray(input_cat[column], dtype=float), np.nan)
+            for column in (args.ra_column, args.dec_column)
         )
-        dec = get_value_from_multi_ext_fits(
-            phot_cat[tier],
-            ColumnNames.DEC[ColumnNames.extension],
-            ColumnNames.DEC[ColumnNames.name],
-            nircam_id,
+        to_process = has_id | (np.isfinite(ra) & np.isfinite(dec))
+    else:
+        ra = dec = None
+        to_process = has_id
+
+    tiers = np.full(len(input_cat), "", dtype=object)
+    tiers[to_process] = get_tiers(input_cat[ColumnNames.TIER][to_process])
+
+    # Partition the input catalogue by tier, so that each tier catalogue is read and
+    # joined in its own worker
+    partitions = {}
+    for tier, catalogue in catalogues.items():
+        in_tier = np.flatnonzero(tiers == tier)
+        if not len(in_tier):
+            continue
+        if not catalogue:
+            raise ValueError(f"{tier} catalogue not provided")
+        partitions[tier] = in_tier
+
+    tasks = [
+        (
+            catalogues[tier],
+            nircam_ids[in_tier],
+            args.cache,
+            ra[in_tier] if ra is not None else None,
+            dec[in_tier] if dec is not None else None,
+            args.match_radius,
         )
+        for tier, in_tier in partitions.items()
+    ]
 
-        output_cat[ColumnNames.RA[ColumnNames.name]][i] = ra
-        output_cat[ColumnNames.DEC[ColumnNames.name]][i] = dec
-        output_cat[ColumnNames.SIZE[ColumnNames.name]][i] = size
-
-        row = np.where(
-            phot_cat[tier][ColumnNames.FLAG].data[ColumnNames.ID] == nircam_id
-        )[0][0]
-
-        if size < FWHM_CUTOFF:
-            phot_type = PhotometryType.circ
-        else:
-            phot_type = PhotometryType.kron
-
-        for filter in DefaultFilters.hst_jwst:
-            flag = phot_cat[tier][ColumnNames.FLAG].data[
-                filter[DefaultFilters.name] + "_" + ColumnNames.FLAG
-            ][row]
-            phot_val = phot_cat[tier][phot_type[PhotometryType.extension]].data[
-                filter[DefaultFilters.name] + "_" + phot_type[DefaultFilters.name]
-            ][row]
-            phot_err = phot_cat[tier][phot_type[PhotometryType.extension]].data[
-                filter[DefaultFilters.name]
-                + "_"
-                + phot_type[DefaultFilters.name]
-                + ColumnNames.error_suffix
-            ][row]
-            if flag == 0 and phot_val != 0:
-                output_cat[filter[DefaultFilters.label]][i] = phot_val
-                output_cat[filter[DefaultFilters.label] + "_" + DefaultFilters.err][
-                    i
-                ] = phot_err
-            else:
-                output_cat[filter[DefaultFilters.label]][i] = -99
-                output_cat[filter[DefaultFilters.label] + "_" + DefaultFilters.err][
-                    i
-                ] = -99
-
-        for filter in DefaultFilters.extra:
-            output_cat[filter][i] = -99
-            output_cat[filter + "_" + DefaultFilters.err][i] = -99
+    workers = args.workers if args.workers is not None else len(tasks)
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            results = pool.starmap(_extract_tier_photometry, tasks)
+    else:
+        results = [_extract_tier_photometry(*task) for task in tasks]
+
+    # Merge the tiers back in the order of the input catalogue
+    for in_tier, (found, columns) in zip(partitions.values(), results):
+        for name, values in columns.items():
+            output_cat[name][in_tier[found]] = values
 
     output_table = Table(output_cat)
 
+    # Record the photometry catalogues used for each tier
+    if args.goods_s:
+        output_table.meta[Tier.goods_s_keyword] = os.path.basename(args.goods_s)
+    if args.goods_n:
+        output_table.meta[Tier.goods_n_keyword] = os.path.basename(args.goods_n)
+
     # Extract the file name from the input catalogue path
     input_file_name = os.path.basename(args.input_catalogue)
 
     # Etract the path from the input catalogue path
     input_path = os.path.dirname(args.input_catalogue)
 
-    # Etract the file name from the photometry catalogue path
-    if args.goods_s:
-        phot_file_name = os.path.basename(args.goods_s).replace(Tier.goods_s_infix, "")
-    elif args.goods_n:
-        phot_file_name = os.path.basename(args.goods_n).replace(Tier.goods_n_infix, "")
+    # Etract the file names from the photometry catalogue paths, which are the same
+    # for the two tiers of a photometry release once the tier is removed
+    phot_file_names = []
+    for catalogue, infix in (
+        (args.goods_s, Tier.goods_s_infix),
+        (args.goods_n, Tier.goods_n_infix),
+    ):
+        if catalogue:
+            phot_file_name = remove_fits_ext(
+                os.path.basename(catalogue).replace(infix, "")
+            )
+            if phot_file_name not in phot_file_names:
+                phot_file_names.append(phot_file_name)
+
+    if not phot_file_names:
+        raise ValueError("No photometry catalogue provided")
 
     output_file_name = (
-        f"{remove_fits_ext(input_file_name)}.{remove_fits_ext(phot_file_name)}.fits"
+        f"{remove_fits_ext(input_file_name)}.{'.'.join(phot_file_names)}.fits"
     )
 
     output_table.write(
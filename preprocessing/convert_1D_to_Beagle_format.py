@@ -1,839 +1,1139 @@
 import numpy as np
 from astropy.io import fits
-from astropy.table import Table
 import matplotlib.pyplot as plt
 import argparse
 import os
-import sys
 import logging
+import time
+import json
+import hashlib
+import queue
+import threading
+from functools import lru_cache, partial
+from multiprocessing import Pool
 
 
 SPLIT_STRING = "Final_products"
 
+MANIFEST_FILE = "conversion_manifest.json"
 
-class Wavelength:
-    prism_clear = np.array(
-        [
-            6.0255e-07,
-            6.05154e-07,
-            6.0777e-07,
-            6.10441e-07,
-            6.13123e-07,
-            6.15862e-07,
-            6.18612e-07,
-            6.2142e-07,
-            6.24241e-07,
-            6.27119e-07,
-            6.30011e-07,
-            6.32962e-07,
-            6.35927e-07,
-            6.38951e-07,
-            6.41991e-07,
-            6.45091e-07,
-            6.48206e-07,
-            6.51383e-07,
-            6.54623e-07,
-            6.57879e-07,
-            6.61199e-07,
-            6.64535e-07,
-            6.67937e-07,
-            6.71404e-07,
-            6.74889e-07,
-            6.78441e-07,
-            6.82012e-07,
-            6.85651e-07,
-            6.89358e-07,
-            6.93085e-07,
-            6.96882e-07,
-            7.0075e-07,
-            7.04639e-07,
-            7.086e-07,
-            7.12634e-07,
-            7.1674e-07,
-            7.20871e-07,
-            7.25076e-07,
-            7.29356e-07,
-            7.33713e-07,
-            7.38095e-07,
-            7.42555e-07,
-            7.47093e-07,
-            7.5171e-07,
-            7.56406e-07,
-            7.61184e-07,
-            7.65991e-07,
-            7.7088e-07,
-            7.75852e-07,
-            7.80907e-07,
-            7.86047e-07,
-            7.91271e-07,
-            7.96581e-07,
-            8.01978e-07,
-            8.07462e-07,
-            8.13034e-07,
-            8.18695e-07,
-            8.24445e-07,
-            8.30286e-07,
-            8.36218e-07,
-            8.42242e-07,
-            8.48359e-07,
-            8.54569e-07,
-            8.60872e-07,
-            8.67319e-07,
-            8.73861e-07,
-            8.80499e-07,
-            8.87234e-07,
-            8.94066e-07,
-            9.01042e-07,
-            9.08116e-07,
-            9.1529e-07,
-            9.22606e-07,
-            9.30023e-07,
-            9.37541e-07,
-            9.452e-07,
-            9.52962e-07,
-            9.60826e-07,
-            9.6883e-07,
-            9.76937e-07,
-            9.85183e-07,
-            9.93533e-07,
-            1.00202e-06,
-            1.01061e-06,
-            1.01933e-06,
-            1.02816e-06,
-            1.03713e-06,
-            1.04622e-06,
-            1.05541e-06,
-            1.06474e-06,
-            1.07419e-06,
-            1.08374e-06,
-            1.09341e-06,
-            1.1032e-06,
-            1.11311e-06,
-            1.12313e-06,
-            1.13325e-06,
-            1.14349e-06,
-            1.15383e-06,
-            1.16428e-06,
-            1.17484e-06,
-            1.18549e-06,
-            1.19624e-06,
-            1.20708e-06,
-            1.21801e-06,
-            1.22903e-06,
-            1.24014e-06,
-            1.25132e-06,
-            1.26259e-06,
-            1.27393e-06,
-            1.28535e-06,
-            1.29684e-06,
-            1.30839e-06,
-            1.32001e-06,
-            1.33169e-06,
-            1.34342e-06,
-            1.35522e-06,
-            1.36706e-06,
-            1.37893e-06,
-            1.39085e-06,
-            1.40281e-06,
-            1.41481e-06,
-            1.42685e-06,
-            1.43889e-06,
-            1.45096e-06,
-            1.46306e-06,
-            1.47519e-06,
-            1.48734e-06,
-            1.49948e-06,
-            1.51163e-06,
-            1.52381e-06,
-            1.53599e-06,
-            1.54819e-06,
-            1.56036e-06,
-            1.57254e-06,
-            1.58472e-06,
-            1.5969e-06,
-            1.60909e-06,
-            1.62123e-06,
-            1.63337e-06,
-            1.64551e-06,
-            1.65764e-06,
-            1.66976e-06,
-            1.68183e-06,
-            1.69389e-06,
-            1.70594e-06,
-            1.71797e-06,
-            1.72999e-06,
-            1.74194e-06,
-            1.75388e-06,
-            1.7658e-06,
-            1.7777e-06,
-            1.78958e-06,
-            1.80144e-06,
-            1.81322e-06,
-            1.82498e-06,
-            1.83672e-06,
-            1.84843e-06,
-            1.86012e-06,
-            1.87177e-06,
-            1.8834e-06,
-            1.89496e-06,
-            1.90648e-06,
-            1.91797e-06,
-            1.92943e-06,
-            1.94086e-06,
-            1.95226e-06,
-            1.96362e-06,
-            1.97495e-06,
-            1.98625e-06,
-            1.99751e-06,
-            2.00874e-06,
-            2.01994e-06,
-            2.03109e-06,
-            2.04222e-06,
-            2.0533e-06,
-            2.06435e-06,
-            2.07536e-06,
-            2.08634e-06,
-            2.09728e-06,
-            2.10818e-06,
-            2.11904e-06,
-            2.12986e-06,
-            2.14065e-06,
-            2.15139e-06,
-            2.1621e-06,
-            2.17276e-06,
-            2.18339e-06,
-            2.19398e-06,
-            2.20453e-06,
-            2.21504e-06,
-            2.2255e-06,
-            2.23593e-06,
-            2.24632e-06,
-            2.25667e-06,
-            2.26702e-06,
-            2.27733e-06,
-            2.28759e-06,
-            2.29782e-06,
-            2.30801e-06,
-            2.31816e-06,
-            2.32826e-06,
-            2.33837e-06,
-            2.34844e-06,
-            2.35846e-06,
-            2.36845e-06,
-            2.37839e-06,
-            2.38829e-06,
-            2.39819e-06,
-            2.40805e-06,
-            2.41787e-06,
-            2.42765e-06,
-            2.43743e-06,
-            2.44717e-06,
-            2.45686e-06,
-            2.46652e-06,
-            2.47613e-06,
-            2.48574e-06,
-            2.49531e-06,
-            2.50484e-06,
-            2.51433e-06,
-            2.52382e-06,
-            2.53327e-06,
-            2.54267e-06,
-            2.55208e-06,
-            2.56144e-06,
-            2.57076e-06,
-            2.58004e-06,
-            2.58932e-06,
-            2.59856e-06,
-            2.60776e-06,
-            2.61695e-06,
-            2.6261e-06,
-            2.63522e-06,
-            2.64433e-06,
-            2.6534e-06,
-            2.66243e-06,
-            2.67145e-06,
-            2.68044e-06,
-            2.68942e-06,
-            2.69836e-06,
-            2.70727e-06,
-            2.71616e-06,
-            2.72502e-06,
-            2.73384e-06,
-            2.74266e-06,
-            2.75143e-06,
-            2.7602e-06,
-            2.76893e-06,
-            2.77763e-06,
-            2.78631e-06,
-            2.79496e-06,
-            2.8036e-06,
-            2.81221e-06,
-            2.82081e-06,
-            2.82937e-06,
-            2.83789e-06,
-            2.84641e-06,
-            2.85489e-06,
-            2.86336e-06,
-            2.87179e-06,
-            2.88022e-06,
-            2.88861e-06,
-            2.897e-06,
-            2.90534e-06,
-            2.91369e-06,
-            2.92199e-06,
-            2.93029e-06,
-            2.93855e-06,
-            2.9468e-06,
-            2.95502e-06,
-            2.96323e-06,
-            2.9714e-06,
-            2.97957e-06,
-            2.9877e-06,
-            2.99582e-06,
-            3.00391e-06,
-            3.01199e-06,
-            3.02004e-06,
-            3.02807e-06,
-            3.03607e-06,
-            3.04407e-06,
-            3.05203e-06,
-            3.05998e-06,
-            3.06793e-06,
-            3.07584e-06,
-            3.08374e-06,
-            3.0916e-06,
-            3.09946e-06,
-            3.10729e-06,
-            3.11511e-06,
-            3.12292e-06,
-            3.13069e-06,
-            3.13846e-06,
-            3.14619e-06,
-            3.15392e-06,
-            3.16161e-06,
-            3.1693e-06,
-            3.17697e-06,
-            3.18462e-06,
-            3.19225e-06,
-            3.19985e-06,
-            3.20745e-06,
-            3.21503e-06,
-            3.22259e-06,
-            3.23013e-06,
-            3.23767e-06,
-            3.24517e-06,
-            3.25267e-06,
-            3.26016e-06,
-            3.26761e-06,
-            3.27506e-06,
-            3.28248e-06,
-            3.28988e-06,
-            3.29728e-06,
-            3.30465e-06,
-            3.31201e-06,
-            3.31936e-06,
-            3.32668e-06,
-            3.33399e-06,
-            3.34129e-06,
-            3.34856e-06,
-            3.35583e-06,
-            3.36308e-06,
-            3.37031e-06,
-            3.37752e-06,
-            3.38473e-06,
-            3.39193e-06,
-            3.3991e-06,
-            3.40626e-06,
-            3.41341e-06,
-            3.42053e-06,
-            3.42765e-06,
-            3.43475e-06,
-            3.44182e-06,
-            3.44889e-06,
-            3.45595e-06,
-            3.463e-06,
-            3.47002e-06,
-            3.47703e-06,
-            3.48404e-06,
-            3.49101e-06,
-            3.49797e-06,
-            3.50493e-06,
-            3.51188e-06,
-            3.5188e-06,
-            3.52571e-06,
-            3.53261e-06,
-            3.53951e-06,
-            3.54637e-06,
-            3.55323e-06,
-            3.56008e-06,
-            3.56692e-06,
-            3.57373e-06,
-            3.58054e-06,
-            3.58733e-06,
-            3.59412e-06,
-            3.60088e-06,
-            3.60763e-06,
-            3.61437e-06,
-            3.62111e-06,
-            3.62783e-06,
-            3.63453e-06,
-            3.64122e-06,
-            3.6479e-06,
-            3.65458e-06,
-            3.66122e-06,
-            3.66786e-06,
-            3.67449e-06,
-            3.68111e-06,
-            3.68772e-06,
-            3.69431e-06,
-            3.70088e-06,
-            3.70745e-06,
-            3.71401e-06,
-            3.72056e-06,
-            3.72709e-06,
-            3.7336e-06,
-            3.74011e-06,
-            3.74661e-06,
-            3.75311e-06,
-            3.75959e-06,
-            3.76605e-06,
-            3.7725e-06,
-            3.77894e-06,
-            3.78537e-06,
-            3.7918e-06,
-            3.7982e-06,
-            3.80459e-06,
-            3.81097e-06,
-            3.81734e-06,
-            3.82371e-06,
-            3.83007e-06,
-            3.83642e-06,
-            3.84274e-06,
-            3.84906e-06,
-            3.85537e-06,
-            3.86167e-06,
-            3.86796e-06,
-            3.87424e-06,
-            3.88052e-06,
-            3.88677e-06,
-            3.89301e-06,
-            3.89924e-06,
-            3.90547e-06,
-            3.91169e-06,
-            3.9179e-06,
-            3.9241e-06,
-            3.93028e-06,
-            3.93645e-06,
-            3.94261e-06,
-            3.94876e-06,
-            3.9549e-06,
-            3.96104e-06,
-            3.96717e-06,
-            3.97329e-06,
-            3.97939e-06,
-            3.98548e-06,
-            3.99156e-06,
-            3.99763e-06,
-            4.00369e-06,
-            4.00975e-06,
-            4.0158e-06,
-            4.02184e-06,
-            4.02788e-06,
-            4.0339e-06,
-            4.0399e-06,
-            4.0459e-06,
-            4.05188e-06,
-            4.05786e-06,
-            4.06383e-06,
-            4.06979e-06,
-            4.07575e-06,
-            4.08169e-06,
-            4.08763e-06,
-            4.09356e-06,
-            4.09949e-06,
-            4.1054e-06,
-            4.11129e-06,
-            4.11718e-06,
-            4.12306e-06,
-            4.12892e-06,
-            4.13479e-06,
-            4.14064e-06,
-            4.14648e-06,
-            4.15232e-06,
-            4.15815e-06,
-            4.16397e-06,
-            4.16979e-06,
-            4.1756e-06,
-            4.1814e-06,
-            4.18719e-06,
-            4.19297e-06,
-            4.19875e-06,
-            4.20452e-06,
-            4.21027e-06,
-            4.216e-06,
-            4.22173e-06,
-            4.22746e-06,
-            4.23317e-06,
-            4.23888e-06,
-            4.24458e-06,
-            4.25028e-06,
-            4.25596e-06,
-            4.26164e-06,
-            4.26731e-06,
-            4.27297e-06,
-            4.27863e-06,
-            4.28428e-06,
-            4.28992e-06,
-            4.29555e-06,
-            4.30117e-06,
-            4.30679e-06,
-            4.3124e-06,
-            4.31801e-06,
-            4.3236e-06,
-            4.32919e-06,
-            4.33477e-06,
-            4.34034e-06,
-            4.34591e-06,
-            4.35147e-06,
-            4.35702e-06,
-            4.36256e-06,
-            4.3681e-06,
-            4.37363e-06,
-            4.37915e-06,
-            4.38466e-06,
-            4.39017e-06,
-            4.39567e-06,
-            4.40116e-06,
-            4.40665e-06,
-            4.41212e-06,
-            4.41759e-06,
-            4.42305e-06,
-            4.42851e-06,
-            4.43396e-06,
-            4.4394e-06,
-            4.44483e-06,
-            4.45026e-06,
-            4.45568e-06,
-            4.46109e-06,
-            4.46649e-06,
-            4.47189e-06,
-            4.47728e-06,
-            4.48266e-06,
-            4.48804e-06,
-            4.49341e-06,
-            4.49877e-06,
-            4.50412e-06,
-            4.50947e-06,
-            4.51481e-06,
-            4.52014e-06,
-            4.52546e-06,
-            4.53078e-06,
-            4.53609e-06,
-            4.54139e-06,
-            4.54669e-06,
-            4.55198e-06,
-            4.55726e-06,
-            4.56254e-06,
-            4.5678e-06,
-            4.57306e-06,
-            4.57832e-06,
-            4.58356e-06,
-            4.58882e-06,
-            4.59406e-06,
-            4.5993e-06,
-            4.60453e-06,
-            4.60976e-06,
-            4.61497e-06,
-            4.62018e-06,
-            4.62539e-06,
-            4.63058e-06,
-            4.63577e-06,
-            4.64095e-06,
-            4.64613e-06,
-            4.6513e-06,
-            4.65646e-06,
-            4.66161e-06,
-            4.66676e-06,
-            4.6719e-06,
-            4.67703e-06,
-            4.68217e-06,
-            4.6873e-06,
-            4.69243e-06,
-            4.69755e-06,
-            4.70266e-06,
-            4.70776e-06,
-            4.71286e-06,
-            4.71795e-06,
-            4.72303e-06,
-            4.72811e-06,
-            4.73318e-06,
-            4.73824e-06,
-            4.7433e-06,
-            4.74835e-06,
-            4.7534e-06,
-            4.75845e-06,
-            4.76349e-06,
-            4.76852e-06,
-            4.77355e-06,
-            4.77857e-06,
-            4.78358e-06,
-            4.78859e-06,
-            4.79359e-06,
-            4.79858e-06,
-            4.80357e-06,
-            4.80856e-06,
-            4.81355e-06,
-            4.81852e-06,
-            4.82349e-06,
-            4.82846e-06,
-            4.83342e-06,
-            4.83837e-06,
-            4.84331e-06,
-            4.84825e-06,
-            4.85318e-06,
-            4.85812e-06,
-            4.86305e-06,
-            4.86797e-06,
-            4.87288e-06,
-            4.87779e-06,
-            4.8827e-06,
-            4.88759e-06,
-            4.89248e-06,
-            4.89736e-06,
-            4.90224e-06,
-            4.90712e-06,
-            4.912e-06,
-            4.91686e-06,
-            4.92172e-06,
-            4.92658e-06,
-            4.93143e-06,
-            4.93627e-06,
-            4.9411e-06,
-            4.94594e-06,
-            4.95077e-06,
-            4.9556e-06,
-            4.96042e-06,
-            4.96523e-06,
-            4.97004e-06,
-            4.97484e-06,
-            4.97963e-06,
-            4.98443e-06,
-            4.98922e-06,
-            4.99401e-06,
-            4.99879e-06,
-            5.00356e-06,
-            5.00832e-06,
-            5.01308e-06,
-            5.01784e-06,
-            5.02259e-06,
-            5.02734e-06,
-            5.03209e-06,
-            5.03683e-06,
-            5.04156e-06,
-            5.04628e-06,
-            5.051e-06,
-            5.05573e-06,
-            5.06044e-06,
-            5.06515e-06,
-            5.06986e-06,
-            5.07455e-06,
-            5.07924e-06,
-            5.08393e-06,
-            5.08862e-06,
-            5.0933e-06,
-            5.09798e-06,
-            5.10265e-06,
-            5.10731e-06,
-            5.11197e-06,
-            5.11662e-06,
-            5.12127e-06,
-            5.12592e-06,
-            5.13056e-06,
-            5.1352e-06,
-            5.13983e-06,
-            5.14445e-06,
-            5.14908e-06,
-            5.1537e-06,
-            5.15832e-06,
-            5.16293e-06,
-            5.16753e-06,
-            5.17213e-06,
-            5.17673e-06,
-            5.18132e-06,
-            5.18591e-06,
-            5.19049e-06,
-            5.19507e-06,
-            5.19964e-06,
-            5.20421e-06,
-            5.20878e-06,
-            5.21334e-06,
-            5.21789e-06,
-            5.22244e-06,
-            5.22698e-06,
-            5.23153e-06,
-            5.23607e-06,
-            5.2406e-06,
-            5.24513e-06,
-            5.24965e-06,
-            5.25417e-06,
-            5.25869e-06,
-            5.2632e-06,
-            5.26771e-06,
-            5.27221e-06,
-            5.2767e-06,
-            5.2812e-06,
-            5.2857e-06,
-            5.29018e-06,
-            5.29466e-06,
-            5.29914e-06,
-            5.30361e-06,
-            5.30808e-06,
-        ]
+# Signature of the redshift catalogues the spec_z/photo_z lists were written from
+REDSHIFT_LISTS_STAMP = "redshift_lists.json"
+
+STACKED_SUFFIX = "_stacked.fits"
+
+# Folder containing the wavelength grids of the configurations whose 1D spectra
+# do not include a WAVELENGTH extension
+WAVELENGTH_GRIDS_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "wavelength_grids"
+)
+
+
+def available_wavelength_grids():
+    """Names of the grating/filter configurations with a registered wavelength grid."""
+    return sorted(
+        os.path.splitext(file)[0]
+        for file in os.listdir(WAVELENGTH_GRIDS_FOLDER)
+        if file.endswith(".npy")
     )
 
 
-parser = argparse.ArgumentParser()
+@lru_cache(maxsize=None)
+def get_wavelength_grid(grating_filter):
+    """Wavelength grid (in m) of the `grating_filter` configuration, or None if no
+    grid is registered for it.
 
-parser.add_argument(
-    "-s",
-    "--spectrum-folder",
-    help="folder containing 1D spectra",
-    action="store",
-    type=str,
-    dest="spectrumFolder",
-    required=True,
-)
+    The grids are stored as `<grating_filter>.npy` files in `WAVELENGTH_GRIDS_FOLDER`,
+    so that a new configuration can be supported by dropping in a new file. Each grid
+    is loaded on first use and then memoised; the returned array is read-only since
+    it is shared by all the spectra of the same configuration.
+    """
+    path = os.path.join(WAVELENGTH_GRIDS_FOLDER, grating_filter + ".npy")
+    if not os.path.isfile(path):
+        return None
 
-# Read logging level
-parser.add_argument(
-    "--log-level",
-    help="logging level",
-    action="store",
-    type=str,
-    dest="logLevel",
-    default="INFO",
-)
+    wl = np.load(path)
+    wl.setflags(write=False)
+    return wl
 
-parser.add_argument(
-    "--input-file",
-    help="Name of the input file or files to be converted",
-    action="store",
-    nargs="+",
-    type=str,
-    dest="inputFiles",
-)
 
-parser.add_argument(
-    "-scaling",
-    "--scaling",
-    help="text file containing noise scaling factor",
-    action="store",
-    type=str,
-    default=None,
-    dest="scalingFactor",
-)
+class ConversionStatus:
+    converted = "converted"
+    skipped = "skipped"
+    failed = "failed"
+
+
+class ManifestKeys:
+    size = "size"
+    mtime = "mtime"
+    checksum = "checksum"
+    scaling = "scaling"
+    header = "header"
+    output = "output"
+    output_checksum = "output_checksum"
+
+
+class HeaderKeys:
+    redshift = "REDSHIFT"
+    z_err = "Z_ERR"
+    sample = "ZSAMPLE"
+    redshift_catalogue = "ZCAT"
+    source_file = "SRCFILE"
+
+
+def spectrum_header(file, grating_filter, catalogue=None):
+    """Header cards, as a `{key: (value, comment)}` dictionary, of the converted
+    spectrum of `file`: its source file and, if the object is in the redshift
+    `catalogue`, its redshift, redshift error and sample."""
+    cards = {HeaderKeys.source_file: (file, "input 1D spectrum")}
+
+    if catalogue is None:
+        return cards
+
+    row = catalogue.lookup(os.path.splitext(output_file_name(file, grating_filter))[0])
+    if row is None:
+        return cards
+
+    if np.isfinite(catalogue.z[row]):
+        cards[HeaderKeys.redshift] = (float(catalogue.z[row]), "redshift")
+    if np.isfinite(catalogue.z_err[row]):
+        cards[HeaderKeys.z_err] = (float(catalogue.z_err[row]), "redshift error")
+    cards[HeaderKeys.sample] = (str(catalogue.sample[row]), "redshift sample")
+    cards[HeaderKeys.redshift_catalogue] = (
+        str(catalogue.source[row]),
+        "redshift catalogue",
+    )
+
+    return cards
+
+
+def read_spectrum(path, grating_filter, scaling=None):
+    """Read a `*_1D.fits` spectrum and convert it to the units used by Beagle.
+
+    Only the `DATA`, `ERR` and (if present) `WAVELENGTH` extensions are
+    memory-mapped, and the file is closed before returning. The unit scaling and
+    the masking are done in place on the output arrays, so that no other full-size
+    temporary is created.
+
+    Returns the wavelength (Angstrom), flux, error and mask arrays.
+    """
+    with fits.open(path, memmap=True, lazy_load_hdus=True) as spectra:
+        wl = spectra["WAVELENGTH"].data if "WAVELENGTH" in spectra else None
+        return _prepare_spectrum(
+            spectra["DATA"].data, spectra["ERR"].data, wl, grating_filter, scaling
+        )
+
+
+def _read_raw_spectrum(path):
+    """Read the `DATA`, `ERR` and (if present) `WAVELENGTH` extensions of a
+    `*_1D.fits` spectrum into memory, without any conversion."""
+    with fits.open(path, memmap=True, lazy_load_hdus=True) as spectra:
+        wl = spectra["WAVELENGTH"].data if "WAVELENGTH" in spectra else None
+        return (
+            np.array(spectra["DATA"].data),
+            np.array(spectra["ERR"].data),
+            None if wl is None else np.array(wl),
+        )
+
+
+def _prepare_spectrum(spec, err, wl, grating_filter, scaling=None):
+    """Convert the flux, error and wavelength arrays of a spectrum to the units used
+    by Beagle and build its mask (see `read_spectrum`)."""
+    if wl is None:
+        wl = get_wavelength_grid(grating_filter)
+
+    if wl is None:
+        raise ValueError(
+            "Cannot determine the wavelength of the spectrum: no WAVELENGTH "
+            f"extension and no wavelength grid registered for {grating_filter} "
+            f"(available: {', '.join(available_wavelength_grids())})"
+        )
+
+    # The arithmetic is done with the precision of the input arrays, and the
+    # result is cast to the double precision of the output columns
+    wl_out = np.multiply(wl, 1e10, out=np.empty(len(wl), dtype=np.float64))
+    flux = np.multiply(spec, 1e-7, out=np.empty(len(spec), dtype=np.float64))
+
+    err_out = np.empty(len(err), dtype=np.float64)
+    if scaling is not None:
+        logging.info("applying scaling factor")
+        np.divide(err, scaling.on_grid(wl, len(err)), out=err_out)
+        err_out *= 1e-7
+    #    plt.figure()
+    #    plt.plot(np.sqrt(spectra['VAR'].data[i,:]))
+    #    plt.plot(np.sqrt(spectra['VAR'].data[i,:])/scaling['scaling_factor'])
+    #    plt.savefig("test.pdf")
+    #    sys.exit()
+    else:
+        np.multiply(err, 1e-7, out=err_out)  # Careful - the factor
+    #     of 1.4 is suggested by Stefano to account for STD being too high
+
+    mask = np.isfinite(spec)
+
+    flux[~mask] = 0
+    err_out[~mask] = 0
+
+    return wl_out, flux, err_out, mask
+
+
+def output_file_name(file, grating_filter):
+    """Name of the Beagle-format file produced from the `*_1D.fits` file `file`."""
+    return file.split("_" + grating_filter)[0] + ".fits"
+
+
+def convert_spectrum(
+    file,
+    spectrumFolder,
+    outputFolder,
+    grating_filter,
+    scaling=None,
+    overwrite=False,
+    cards=None,
+):
+    """Convert a single `*_1D.fits` spectrum to the Beagle format.
+
+    `cards` are written to the primary header of the output (see `spectrum_header`).
+    Returns one of the `ConversionStatus` values.
+    """
+    outputFile = os.path.join(outputFolder, output_file_name(file, grating_filter))
+
+    if not overwrite and os.path.isfile(outputFile):
+        logging.info(f"Skipping {file} because the output file already exists")
+        return ConversionStatus.skipped
+
+    wl, flux, err, mask = read_spectrum(
+        os.path.join(spectrumFolder, file), grating_filter, scaling
+    )
+
+    write_spectrum(outputFile, wl, flux, err, mask, _header_from_cards(cards))
+
+    return ConversionStatus.converted
+
+
+def _header_from_cards(cards):
+    hdr = fits.Header()
+    for key, card in (cards or {}).items():
+        hdr[key] = card
+    return hdr
+
+
+def write_spectrum(outputFile, wl, flux, err, mask, hdr=None):
+    """Write a spectrum to a Beagle-format FITS file."""
+    spectrum_hdulist(wl, flux, err, mask, hdr).writeto(outputFile, overwrite=True)
+
+
+def spectrum_hdulist(wl, flux, err, mask, hdr=None):
+    """Build the Beagle-format `HDUList` of a spectrum."""
+    empty_primary = fits.PrimaryHDU(header=hdr)
+
+    col1 = fits.Column(name="wl", format="D", array=wl)
+    col2 = fits.Column(name="flux", format="D", array=flux)
+    col3 = fits.Column(name="err", format="D", array=err)
+    col4 = fits.Column(name="mask", format="L", array=mask)
+    cols = fits.ColDefs([col1, col2, col3, col4])
+    hdu = fits.BinTableHDU.from_columns(cols)
+    return fits.HDUList([empty_primary, hdu])
+
+
+def _convert_spectrum_isolated(
+    file,
+    cards,
+    spectrumFolder,
+    outputFolder,
+    grating_filter,
+    scaling=None,
+    scaling_checksum=None,
+):
+    """Wrapper around `convert_spectrum` that turns any error into a `failed` status,
+    so that a single bad spectrum does not abort the whole batch.
+
+    Returns the input file, its status and, for converted files, its manifest entry.
+    """
+    try:
+        status = convert_spectrum(
+            file,
+            spectrumFolder,
+            outputFolder,
+            grating_filter,
+            scaling,
+            overwrite=True,
+            cards=cards,
+        )
+        entry = _manifest_entry(
+            file, spectrumFolder, outputFolder, grating_filter, scaling_checksum, cards
+        )
+        return file, status, entry
+    except Exception as e:
+        logging.error(f"Error converting {file}: {e}")
+        return file, ConversionStatus.failed, None
+
+
+def _read_spectrum_isolated(file, spectrumFolder, grating_filter, scaling=None):
+    """Wrapper around `read_spectrum` that turns any error into a `failed` status."""
+    try:
+        return file, read_spectrum(
+            os.path.join(spectrumFolder, file), grating_filter, scaling
+        )
+    except Exception as e:
+        logging.error(f"Error reading {file}: {e}")
+        return file, None
+
 
-args = parser.parse_args()
+def _convert_pipelined(
+    files,
+    headers,
+    spectrumFolder,
+    outputFolder,
+    grating_filter,
+    scaling=None,
+    scaling_checksum=None,
+    depth=4,
+):
+    """Convert `files` with a three-stage pipeline, so that reading file N+1,
+    converting file N and writing file N-1 overlap.
 
-logging.basicConfig(level=args.logLevel)
+    A background thread reads the spectra ahead into a queue of at most `depth`
+    spectra, the calling thread converts them, and another background thread writes
+    the outputs. Errors are isolated per file as in `_convert_spectrum_isolated`.
+    The time each stage spent waiting on its queues and the mean queue depths are
+    logged, to tune `depth` for a given filesystem.
 
-args.spectrumFolder = os.path.abspath(args.spectrumFolder)
-outputFolder = os.path.join(args.spectrumFolder, "beagle_format")
+    Returns a list of (input file, status, manifest entry) tuples.
+    """
+    read_queue = queue.Queue(maxsize=depth)
+    write_queue = queue.Queue(maxsize=depth)
+    waits = {"read": 0.0, "convert": 0.0, "write": 0.0}
+    depths = {"read": [], "write": []}
+    results = []
 
-# Make the output directory if it doesn't exist yet
-if not os.path.exists(outputFolder):
-    os.mkdir(outputFolder)
+    def _timed(stage, function, *args):
+        start = time.perf_counter()
+        value = function(*args)
+        waits[stage] += time.perf_counter() - start
+        return value
 
-spectraList = os.listdir(args.spectrumFolder)
+    def reader():
+        for file, cards in zip(files, headers):
+            try:
+                raw = _read_raw_spectrum(os.path.join(spectrumFolder, file))
+            except Exception as e:
+                raw = e
+            _timed("read", read_queue.put, (file, cards, raw))
+        read_queue.put(None)
 
-# If a redshift catalogue exists, use it to create the lists of objects with spec_z and photo_z
-redshift_folder = os.path.join(args.spectrumFolder.split(SPLIT_STRING)[0], "redshifts")
-if os.path.exists(redshift_folder):
-    for filename in os.listdir(redshift_folder):
-        if filename.endswith(".fits"):
+    def writer():
+        while True:
+            depths["write"].append(write_queue.qsize())
+            task = _timed("write", write_queue.get)
+            if task is None:
+                break
+
+            file, cards, hdul = task
+            try:
+                outputFile = os.path.join(
+                    outputFolder, output_file_name(file, grating_filter)
+                )
+                hdul.writeto(outputFile, overwrite=True)
+                entry = _manifest_entry(
+                    file,
+                    spectrumFolder,
+                    outputFolder,
+                    grating_filter,
+                    scaling_checksum,
+                    cards,
+                )
+                results.append((file, ConversionStatus.converted, entry))
+            except Exception as e:
+                logging.error(f"Error converting {file}: {e}")
+                results.append((file, ConversionStatus.failed, None))
+
+    # The reader is a daemon, so that it cannot block the interpreter if the
+    # conversion loop is interrupted while the read-ahead queue is full
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer)
+    reader_thread.start()
+    writer_thread.start()
+
+    try:
+        while True:
+            depths["read"].append(read_queue.qsize())
+            task = _timed("convert", read_queue.get)
+            if task is None:
+                break
+
+            file, cards, raw = task
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                hdul = spectrum_hdulist(
+                    *_prepare_spectrum(*raw, grating_filter, scaling),
+                    _header_from_cards(cards),
+                )
+            except Exception as e:
+                logging.error(f"Error converting {file}: {e}")
+                results.append((file, ConversionStatus.failed, None))
+                continue
+
+            _timed("convert", write_queue.put, (file, cards, hdul))
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+
+    logging.info(
+        f"Pipeline (depth {depth}): "
+        f"mean read-ahead queue depth {np.mean(depths['read'] or [0]):.1f}, "
+        f"mean write queue depth {np.mean(depths['write'] or [0]):.1f}; "
+        f"waits: reader {waits['read']:.2f} s, converter {waits['convert']:.2f} s, "
+        f"writer {waits['write']:.2f} s"
+    )
+
+    return results
+
+
+def _file_checksum(path, chunk_size=1 << 20):
+    """SHA-1 checksum of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _header_values(cards):
+    return {key: value for key, (value, _) in (cards or {}).items()}
+
+
+def _manifest_entry(
+    file, spectrumFolder, outputFolder, grating_filter, scaling_checksum, cards=None
+):
+    """Manifest entry describing the input file `file` and its converted output."""
+    path = os.path.join(spectrumFolder, file)
+    stat = os.stat(path)
+    output = output_file_name(file, grating_filter)
+    return {
+        ManifestKeys.size: stat.st_size,
+        ManifestKeys.mtime: stat.st_mtime_ns,
+        ManifestKeys.checksum: _file_checksum(path),
+        ManifestKeys.scaling: scaling_checksum,
+        ManifestKeys.header: _header_values(cards),
+        ManifestKeys.output: output,
+        ManifestKeys.output_checksum: _file_checksum(os.path.join(outputFolder, output)),
+    }
+
+
+def load_manifest(outputFolder):
+    """Read the conversion manifest of a `beagle_format` folder, or return an empty
+    manifest if it does not exist (yet)."""
+    manifest_file = os.path.join(outputFolder, MANIFEST_FILE)
+    if not os.path.isfile(manifest_file):
+        return {}
+
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning(f"Ignoring corrupted conversion manifest {manifest_file}")
+        return {}
+
+
+def save_manifest(outputFolder, manifest):
+    """Write the conversion manifest atomically, so that an interrupted run never
+    leaves a truncated manifest behind."""
+    manifest_file = os.path.join(outputFolder, MANIFEST_FILE)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def _is_up_to_date(
+    entry, stat, spectrumFolder, outputFolder, file, scaling_checksum, cards=None
+):
+    """Check, using the manifest `entry`, whether the output of `file` is up to date.
+
+    The output is out of date if the scaling file or the header values (e.g. the
+    redshift) changed. The input is only read (to compute its checksum) when its size
+    or modification time differ from the ones recorded in the manifest. If the
+    content did not change, the entry is updated in place with the new modification
+    time.
+    """
+    if entry is None or entry.get(ManifestKeys.scaling) != scaling_checksum:
+        return False
+
+    if entry.get(ManifestKeys.header) != _header_values(cards):
+        return False
+
+    if not os.path.isfile(os.path.join(outputFolder, entry[ManifestKeys.output])):
+        return False
+
+    if (
+        entry[ManifestKeys.size] == stat.st_size
+        and entry[ManifestKeys.mtime] == stat.st_mtime_ns
+    ):
+        return True
+
+    if entry[ManifestKeys.checksum] == _file_checksum(os.path.join(spectrumFolder, file)):
+        entry[ManifestKeys.size] = stat.st_size
+        entry[ManifestKeys.mtime] = stat.st_mtime_ns
+        return True
+
+    return False
+
+
+def _remove_stale_outputs(manifest, present, outputFolder):
+    """Remove the outputs (and manifest entries) of input files that disappeared."""
+    removed = [file for file in manifest if file not in present]
+    live_outputs = {
+        entry[ManifestKeys.output]
+        for file, entry in manifest.items()
+        if file in present
+    }
+    for file in removed:
+        output = manifest.pop(file)[ManifestKeys.output]
+        outputFile = os.path.join(outputFolder, output)
+        if output not in live_outputs and os.path.isfile(outputFile):
+            logging.info(f"Removing {output} because {file} no longer exists")
+            os.remove(outputFile)
+    return removed
+
+
+def _log_summary(statuses, wall_time):
+    counts = {
+        status: sum(1 for s in statuses.values() if s == status)
+        for status in (
+            ConversionStatus.converted,
+            ConversionStatus.skipped,
+            ConversionStatus.failed,
+        )
+    }
+    logging.info(
+        f"Conversion summary: {counts[ConversionStatus.converted]} converted, "
+        f"{counts[ConversionStatus.skipped]} skipped, "
+        f"{counts[ConversionStatus.failed]} failed "
+        f"in {wall_time:.2f} s"
+    )
+    for file, status in sorted(statuses.items()):
+        if status == ConversionStatus.failed:
+            logging.warning(f"Failed to convert {file}")
+
+
+class RedshiftCatalogue:
+    """Merged content of all the redshift catalogues of a `redshifts` folder, with an
+    ID -> row index shared by all the grating/filter folders of the programme.
+
+    Catalogues are merged in alphabetical order; if an ID appears in more than one
+    catalogue, the last one takes precedence.
+    """
+
+    def __init__(self, redshift_folder, files):
+        IDs, z, z_err, samples, sources = [], [], [], [], []
+        for filename in files:
             # Open the FITS file
             with fits.open(os.path.join(redshift_folder, filename)) as hdul:
                 # Assuming the data you want is in the first extension
-                data = Table(hdul[1].data)
-                if "sample" in data.colnames:
-                    spec_z_IDs = [
-                        str(id) + ".fits"
-                        for id in data[data["sample"] == "spec_z"]["ID"]
-                    ]
-                    spec_phot_z_IDs = [
-                        str(id) + ".fits" for id in data[data["sample"] != ""]["ID"]
-                    ]
-
-                    # Define the filename for the output file
-                    output_filename = "spectra_spec_z.list"
-
-                    # Open the file in write mode ('w')
-                    with open(os.path.join(outputFolder, output_filename), "w") as file:
-                        for id in spec_z_IDs:
-                            file.write(id + "\n")  # Write each ID on a new line
-
-                    # Define the filename for the output file
-                    output_filename = "spectra_spec_phot_z.list"
-
-                    # Open the file in write mode ('w')
-                    with open(os.path.join(outputFolder, output_filename), "w") as file:
-                        for id in spec_phot_z_IDs:
-                            file.write(id + "\n")  # Write each ID on a new line
-
-
-if args.scalingFactor is not None:
-    scaling = np.genfromtxt(args.scalingFactor, dtype=None, names=True)
-else:
-    scaling = None
-
-grating_filter = os.path.basename(os.path.normpath(args.spectrumFolder))
-
-for file in spectraList:
-    if args.inputFiles and file not in args.inputFiles:
-        logging.info(f"Skipping {file} because it is not in the input files list")
-        continue
-    if file.endswith("1D.fits"):
-        outputFile = file.split("_" + grating_filter)[0] + ".fits"
-        outputFile = os.path.join(outputFolder, outputFile)
-        if os.path.isfile(outputFile):
-            logging.info(f"Skipping {file} because the output file already exists")
+                data = hdul[1].data
+                names = data.columns.names
+                IDs.append(np.char.strip(np.asarray(data["ID"]).astype(str)))
+                for values, name in ((z, "z"), (z_err, "z_err")):
+                    if name in names:
+                        values.append(np.asarray(data[name], dtype=np.float64))
+                    else:
+                        values.append(np.full(len(data), np.nan))
+                if "sample" in names:
+                    samples.append(np.char.strip(np.asarray(data["sample"]).astype(str)))
+                else:
+                    samples.append(np.full(len(data), "", dtype=str))
+                sources.append(np.full(len(data), filename))
+
+        IDs = np.concatenate(IDs)
+
+        # Keep only the last occurrence of each ID, preserving the catalogue order.
+        # IDs are compared as they are looked up, irrespective of their zero padding
+        keys = np.array([_normalise_id(ID) for ID in IDs], dtype=str)
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(IDs) - 1 - last)
+        if len(keep) < len(IDs):
+            logging.warning(
+                f"{len(IDs) - len(keep)} IDs appear in more than one redshift "
+                f"catalogue in {redshift_folder}, using the last occurrence"
+            )
+
+        self.IDs = IDs[keep]
+        self.z = np.concatenate(z)[keep]
+        self.z_err = np.concatenate(z_err)[keep]
+        self.sample = np.concatenate(samples)[keep]
+        self.source = np.concatenate(sources)[keep]
+        self.index = {_normalise_id(ID): row for row, ID in enumerate(self.IDs)}
+
+    def lookup(self, ID):
+        """Row of object `ID` in the merged catalogue, or None if it is not there."""
+        return self.index.get(_normalise_id(ID))
+
+    def spec_z_IDs(self):
+        return self.IDs[self.sample == "spec_z"]
+
+    def spec_phot_z_IDs(self):
+        return self.IDs[self.sample != ""]
+
+
+def _normalise_id(ID):
+    # Numerical IDs are matched irrespective of their zero padding
+    ID = str(ID).strip()
+    return str(int(ID)) if ID.isdigit() else ID
+
+
+# Redshift catalogues already loaded in this process, keyed by folder
+_redshift_catalogues = {}
+
+
+def load_redshift_catalogue(redshift_folder):
+    """Load (once) the merged `RedshiftCatalogue` of `redshift_folder`.
+
+    The catalogue is cached in memory and reloaded only if a redshift catalogue is
+    added, removed or modified. Returns the catalogue and the signature of its input
+    files, i.e. their (name, mtime) pairs, or (None, None) if the folder contains no
+    catalogue.
+    """
+    files = sorted(
+        filename for filename in os.listdir(redshift_folder) if filename.endswith(".fits")
+    )
+    if not files:
+        return None, None
+
+    signature = tuple(
+        (filename, os.stat(os.path.join(redshift_folder, filename)).st_mtime_ns)
+        for filename in files
+    )
+
+    cached = _redshift_catalogues.get(redshift_folder)
+    if cached is None or cached[0] != signature:
+        cached = (signature, RedshiftCatalogue(redshift_folder, files))
+        _redshift_catalogues[redshift_folder] = cached
+
+    return cached[1], cached[0]
+
+
+def _write_list(file_name, IDs):
+    # Write each ID on a new line
+    with open(file_name, "w") as file:
+        file.write("".join(np.char.add(IDs, ".fits\n")))
+
+
+def _redshift_catalogue_of(spectrumFolder):
+    # The redshift catalogues of a programme live next to its Final_products folder
+    redshift_folder = os.path.join(spectrumFolder.split(SPLIT_STRING)[0], "redshifts")
+    if not os.path.exists(redshift_folder):
+        return None, None
+
+    return load_redshift_catalogue(redshift_folder)
+
+
+def write_redshift_lists(spectrumFolder, outputFolder):
+    """If a redshift catalogue exists, use it to create the lists of objects with
+    spec_z and photo_z in the output folder.
+
+    The lists are only rewritten if the redshift catalogues they were written from
+    have been added, removed or modified since.
+    """
+    spec_z_list = os.path.join(outputFolder, "spectra_spec_z.list")
+    spec_phot_z_list = os.path.join(outputFolder, "spectra_spec_phot_z.list")
+    stamp_file = os.path.join(outputFolder, REDSHIFT_LISTS_STAMP)
+
+    catalogue, signature = _redshift_catalogue_of(spectrumFolder)
+    if catalogue is None:
+        # Remove the lists written from redshift catalogues that no longer exist
+        if os.path.isfile(stamp_file):
+            for file_name in (spec_z_list, spec_phot_z_list, stamp_file):
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+        return
+
+    signature = [list(item) for item in signature]
+
+    if os.path.isfile(spec_z_list) and os.path.isfile(spec_phot_z_list):
+        try:
+            with open(stamp_file, "r") as f:
+                if json.load(f) == signature:
+                    return
+        except (OSError, ValueError):
+            pass
+
+    _write_list(spec_z_list, catalogue.spec_z_IDs())
+    _write_list(spec_phot_z_list, catalogue.spec_phot_z_IDs())
+
+    # Stamp the lists last, so that an interrupted run rewrites them
+    with open(stamp_file + ".tmp", "w") as f:
+        json.dump(signature, f)
+    os.replace(stamp_file + ".tmp", stamp_file)
+
+
+class ScalingFactors:
+    """Noise scaling factors read from a text file with a `scaling_factor` column.
+
+    If the file also has a `wl` (or `wavelength`) column, in the same units (m) as
+    the `WAVELENGTH` extension of the spectra, the factors are interpolated onto the
+    wavelength grid of each spectrum (and extended with their edge values outside
+    the tabulated range); the tabulated range must overlap the spectrum. Otherwise
+    the factors are applied pixel by pixel, and the spectrum must have the same
+    number of pixels as the file.
+    """
+
+    def __init__(self, scalingFactor):
+        data = np.genfromtxt(scalingFactor, dtype=None, names=True)
+        self.file = scalingFactor
+        self.factor = np.atleast_1d(np.asarray(data["scaling_factor"], dtype=np.float64))
+        self.wl = None
+
+        for name in ("wl", "wavelength"):
+            if name in data.dtype.names:
+                wl = np.atleast_1d(np.asarray(data[name], dtype=np.float64))
+                order = np.argsort(wl)
+                self.wl, self.factor = wl[order], self.factor[order]
+                break
+
+    def on_grid(self, wl, n_pixels):
+        """Scaling factors for a spectrum with `n_pixels` pixels at wavelengths `wl`."""
+        if self.wl is not None:
+            # Without any overlap (e.g. a file in other units, or for another
+            # grating) every pixel would silently get an edge value
+            if np.nanmax(wl) < self.wl[0] or np.nanmin(wl) > self.wl[-1]:
+                raise ValueError(
+                    f"the wavelengths of {self.file} ({self.wl[0]:.4g}-"
+                    f"{self.wl[-1]:.4g}) do not overlap the spectrum "
+                    f"({np.nanmin(wl):.4g}-{np.nanmax(wl):.4g})"
+                )
+            return np.interp(wl, self.wl, self.factor)
+
+        # check length of scaling array and error array
+        if n_pixels != len(self.factor):
+            raise ValueError(
+                f"check length of scaling factor array: {self.file} has "
+                f"{len(self.factor)} values, the spectrum has {n_pixels} pixels"
+            )
+
+        return self.factor
+
+
+@lru_cache(maxsize=None)
+def load_scaling(scalingFactor):
+    """Read (once) the text file containing the noise scaling factor."""
+    if scalingFactor is None:
+        return None
+
+    return ScalingFactors(scalingFactor)
+
+
+def scaling_file_for(scalingFactor, grating_filter):
+    """Select the scaling file to use for a grating/filter folder.
+
+    `scalingFactor` is either a single file, or a list of files each given either as
+    `<grating_filter>=<file>`, for a specific configuration, or as `<file>`, as a
+    default for all the others. Returns None if no file applies.
+    """
+    if scalingFactor is None or isinstance(scalingFactor, str):
+        return scalingFactor
+
+    default = None
+    for spec in scalingFactor:
+        name, sep, file = spec.partition("=")
+        if not sep:
+            default = spec
+        elif name == grating_filter:
+            return file
+
+    return default
+
+
+def convert_folder(
+    spectrumFolder, inputFiles=None, scalingFactor=None, workers=1, prefetch=0
+):
+    """Convert all the `*_1D.fits` spectra in `spectrumFolder` to the Beagle format.
+
+    The converted spectra are written to the `beagle_format` sub-folder, together
+    with a manifest recording the size, modification time and checksum of each
+    input, the scaling file used and the checksum of the output. On re-runs only new
+    or changed spectra are converted, and the outputs of input files that no longer
+    exist are removed.
+
+    With `prefetch` > 0 the files are converted with a read/convert/write pipeline
+    (see `_convert_pipelined`) with a read-ahead queue of `prefetch` spectra,
+    instead of with a pool of `workers` processes.
+
+    Returns a dictionary mapping each input file to its `ConversionStatus`.
+    """
+    spectrumFolder = os.path.abspath(spectrumFolder)
+    outputFolder = os.path.join(spectrumFolder, "beagle_format")
+
+    # Make the output directory if it doesn't exist yet
+    if not os.path.exists(outputFolder):
+        os.mkdir(outputFolder)
+
+    write_redshift_lists(spectrumFolder, outputFolder)
+
+    grating_filter = os.path.basename(os.path.normpath(spectrumFolder))
+
+    scalingFactor = scaling_file_for(scalingFactor, grating_filter)
+    scaling = load_scaling(scalingFactor)
+    scaling_checksum = _file_checksum(scalingFactor) if scalingFactor else None
+
+    catalogue, _ = _redshift_catalogue_of(spectrumFolder)
+
+    manifest = load_manifest(outputFolder)
+
+    start = time.perf_counter()
+
+    # A single pass over the folder gives both the file names and their stat
+    stats = {}
+    with os.scandir(spectrumFolder) as entries:
+        for entry in entries:
+            if entry.name.endswith("1D.fits") and entry.is_file():
+                stats[entry.name] = entry.stat()
+
+    if not inputFiles:
+        _remove_stale_outputs(manifest, stats, outputFolder)
+
+    statuses = {}
+    files = []
+    headers = []
+    for file, stat in sorted(stats.items()):
+        if inputFiles and file not in inputFiles:
+            logging.info(f"Skipping {file} because it is not in the input files list")
             continue
-        spectra = fits.open(os.path.join(args.spectrumFolder, file))
-        hdr = fits.Header()
-        # If you want to add the redshift to the header, do it here
-        empty_primary = fits.PrimaryHDU(header=hdr)
-        spec = spectra["DATA"].data
-        if scaling is not None:
-            # check length of scaling array and error array
-            if len(spectra["ERR"].data) != len(scaling["scaling_factor"]):
-                logging.error("check length of scaling factor array")
-                sys.exit()
-            logging.info("applying scaling factor")
-            err = spectra["ERR"].data / scaling["scaling_factor"]
-        #    plt.figure()
-        #    plt.plot(np.sqrt(spectra['VAR'].data[i,:]))
-        #    plt.plot(np.sqrt(spectra['VAR'].data[i,:])/scaling['scaling_factor'])
-        #    plt.savefig("test.pdf")
-        #    sys.exit()
+
+        cards = spectrum_header(file, grating_filter, catalogue)
+
+        entry = manifest.get(file)
+        if _is_up_to_date(
+            entry, stat, spectrumFolder, outputFolder, file, scaling_checksum, cards
+        ):
+            logging.info(f"Skipping {file} because it has not changed")
+            statuses[file] = ConversionStatus.skipped
         else:
-            err = spectra["ERR"].data  # Careful - the factor
-        #     of 1.4 is suggested by Stefano to account for STD being too high
-        maskIdx = np.where(np.isfinite(spec) == False)[0]
-        spec[maskIdx] = 0
-        err[maskIdx] = 0
-        if "WAVELENGTH" in spectra:
-            wl = spectra["WAVELENGTH"].data
+            # Outputs converted before the manifest existed lack the header values
+            # of the current format, so they are converted again
+            files.append(file)
+            headers.append(cards)
+
+    convert = partial(
+        _convert_spectrum_isolated,
+        spectrumFolder=spectrumFolder,
+        outputFolder=outputFolder,
+        grating_filter=grating_filter,
+        scaling=scaling,
+        scaling_checksum=scaling_checksum,
+    )
+
+    if prefetch > 0:
+        results = _convert_pipelined(
+            files,
+            headers,
+            spectrumFolder,
+            outputFolder,
+            grating_filter,
+            scaling,
+            scaling_checksum,
+            depth=prefetch,
+        )
+    elif workers > 1 and len(files) > 1:
+        # Each worker converts whole files, so the output is identical to the serial path
+        with Pool(min(workers, len(files))) as pool:
+            results = pool.starmap(convert, zip(files, headers))
+    else:
+        results = list(map(convert, files, headers))
+
+    for file, status, entry in results:
+        statuses[file] = status
+        if entry is not None:
+            manifest[file] = entry
         else:
-            wl = getattr(Wavelength, grating_filter, None)
+            manifest.pop(file, None)
+
+    save_manifest(outputFolder, manifest)
+
+    _log_summary(statuses, time.perf_counter() - start)
+
+    return statuses
+
+
+def stacked_file_name(grating_filter):
+    """Name of the file holding all the spectra of a grating/filter folder."""
+    return grating_filter + STACKED_SUFFIX
+
+
+def write_stacked(
+    outputFile, IDs, files, wl, flux, err, mask, float32=False, headers=None
+):
+    """Write all the spectra of a grating/filter folder into a single FITS file.
+
+    The file contains a single shared `WAVELENGTH` grid (Angstrom), the `FLUX`, `ERR`
+    and `MASK` 2D images with one row per spectrum, and an `INDEX` table mapping
+    each ID (and input file) to its row, together with the redshift information of
+    the per-object `headers` (see `spectrum_header`).
+    """
+    dtype = np.float32 if float32 else np.float64
+
+    hdr = fits.Header()
+    hdr["NSPEC"] = (len(IDs), "number of stacked spectra")
+
+    index = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="ID", format=f"{max(map(len, IDs))}A", array=IDs),
+            fits.Column(name="file", format=f"{max(map(len, files))}A", array=files),
+            fits.Column(name="row", format="J", array=np.arange(len(IDs))),
+        ]
+        + _redshift_columns(headers or [{}] * len(IDs)),
+        name="INDEX",
+    )
+
+    hdul = fits.HDUList(
+        [
+            fits.PrimaryHDU(header=hdr),
+            fits.ImageHDU(wl, name="WAVELENGTH"),
+            fits.ImageHDU(flux.astype(dtype, copy=False), name="FLUX"),
+            fits.ImageHDU(err.astype(dtype, copy=False), name="ERR"),
+            fits.ImageHDU(mask.astype(np.uint8), name="MASK"),
+            index,
+        ]
+    )
+    hdul.writeto(outputFile, overwrite=True)
+
+
+def _redshift_columns(headers):
+    columns = []
+    for key in (HeaderKeys.redshift, HeaderKeys.z_err):
+        values = [cards.get(key, (np.nan,))[0] for cards in headers]
+        columns.append(fits.Column(name=key, format="D", array=values))
+    for key in (HeaderKeys.sample, HeaderKeys.redshift_catalogue):
+        values = [cards.get(key, ("",))[0] for cards in headers]
+        width = max(1, max(map(len, values)))
+        columns.append(fits.Column(name=key, format=f"{width}A", array=values))
+    return columns
+
+
+def extract_stacked_spectrum(stackedFile, ID, outputFile):
+    """Extract the spectrum of object `ID` from a stacked file and write it to a
+    per-object Beagle-format file."""
+    with fits.open(stackedFile, memmap=True) as hdul:
+        IDs = np.char.strip(hdul["INDEX"].data["ID"])
+        rows = np.flatnonzero(IDs == ID)
+        if len(rows) == 0:
+            raise KeyError(f"ID {ID} not found in {stackedFile}")
+        index = hdul["INDEX"].data[rows[0]]
+        row = index["row"]
+
+        hdr = fits.Header()
+        hdr[HeaderKeys.source_file] = (index["file"], "input 1D spectrum")
+        names = hdul["INDEX"].columns.names
+        if HeaderKeys.redshift in names:
+            if np.isfinite(index[HeaderKeys.redshift]):
+                hdr[HeaderKeys.redshift] = (index[HeaderKeys.redshift], "redshift")
+            if np.isfinite(index[HeaderKeys.z_err]):
+                hdr[HeaderKeys.z_err] = (index[HeaderKeys.z_err], "redshift error")
+            if index[HeaderKeys.redshift_catalogue]:
+                hdr[HeaderKeys.sample] = (index[HeaderKeys.sample], "redshift sample")
+                hdr[HeaderKeys.redshift_catalogue] = (
+                    index[HeaderKeys.redshift_catalogue],
+                    "redshift catalogue",
+                )
+
+        write_spectrum(
+            outputFile,
+            hdul["WAVELENGTH"].data,
+            hdul["FLUX"].data[row],
+            hdul["ERR"].data[row],
+            hdul["MASK"].data[row].astype(bool),
+            hdr,
+        )
+
+
+def convert_folder_stacked(
+    spectrumFolder, inputFiles=None, scalingFactor=None, workers=1, float32=False
+):
+    """Convert all the `*_1D.fits` spectra in `spectrumFolder` into a single stacked
+    file in the `beagle_format` sub-folder (see `write_stacked`).
+
+    All the spectra must share the same wavelength grid; those that do not are
+    reported as failed. Returns a dictionary mapping each input file to its
+    `ConversionStatus`.
+    """
+    spectrumFolder = os.path.abspath(spectrumFolder)
+    outputFolder = os.path.join(spectrumFolder, "beagle_format")
+
+    # Make the output directory if it doesn't exist yet
+    if not os.path.exists(outputFolder):
+        os.mkdir(outputFolder)
+
+    write_redshift_lists(spectrumFolder, outputFolder)
+
+    grating_filter = os.path.basename(os.path.normpath(spectrumFolder))
+
+    scaling = load_scaling(scaling_file_for(scalingFactor, grating_filter))
+
+    catalogue, _ = _redshift_catalogue_of(spectrumFolder)
+
+    start = time.perf_counter()
+
+    files = sorted(
+        file
+        for file in os.listdir(spectrumFolder)
+        if file.endswith("1D.fits") and (not inputFiles or file in inputFiles)
+    )
+
+    read = partial(
+        _read_spectrum_isolated,
+        spectrumFolder=spectrumFolder,
+        grating_filter=grating_filter,
+        scaling=scaling,
+    )
+
+    if workers > 1 and len(files) > 1:
+        with Pool(min(workers, len(files))) as pool:
+            results = list(pool.imap(read, files))
+    else:
+        results = list(map(read, files))
+
+    statuses = {}
+    stacked = []
+    wl = None
+    for file, spectrum in results:
+        if spectrum is None:
+            statuses[file] = ConversionStatus.failed
+            continue
+
         if wl is None:
-            raise ValueError("Cannot determine the wavelength of the spectrum")
-        col1 = fits.Column(name="wl", format="D", array=wl * 1e10)
-        col2 = fits.Column(name="flux", format="D", array=spec * 1e-7)
-        col3 = fits.Column(name="err", format="D", array=err * 1e-7)
-        mask = np.zeros_like(spec) + 1
-        mask[maskIdx] = False
-        col4 = fits.Column(name="mask", format="L", array=mask)
-        cols = fits.ColDefs([col1, col2, col3, col4])
-        hdu = fits.BinTableHDU.from_columns(cols)
-        hdul = fits.HDUList([empty_primary, hdu])
-        hdul.writeto(outputFile, overwrite=True)
+            wl = spectrum[0]
+        elif not np.array_equal(spectrum[0], wl):
+            logging.error(
+                f"Error converting {file}: its wavelength grid differs from "
+                f"the one of {stacked[0][0]}"
+            )
+            statuses[file] = ConversionStatus.failed
+            continue
+
+        stacked.append((file, spectrum))
+        statuses[file] = ConversionStatus.converted
+
+    if stacked:
+        IDs = [
+            os.path.splitext(output_file_name(file, grating_filter))[0]
+            for file, _ in stacked
+        ]
+        write_stacked(
+            os.path.join(outputFolder, stacked_file_name(grating_filter)),
+            IDs,
+            [file for file, _ in stacked],
+            wl,
+            np.stack([spectrum[1] for _, spectrum in stacked]),
+            np.stack([spectrum[2] for _, spectrum in stacked]),
+            np.stack([spectrum[3] for _, spectrum in stacked]),
+            float32=float32,
+            headers=[
+                spectrum_header(file, grating_filter, catalogue) for file, _ in stacked
+            ],
+        )
+
+    _log_summary(statuses, time.perf_counter() - start)
+
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-s",
+        "--spectrum-folder",
+        help="folder containing 1D spectra",
+        action="store",
+        type=str,
+        dest="spectrumFolder",
+        required=True,
+    )
+
+    # Read logging level
+    parser.add_argument(
+        "--log-level",
+        help="logging level",
+        action="store",
+        type=str,
+        dest="logLevel",
+        default="INFO",
+    )
+
+    parser.add_argument(
+        "--input-file",
+        help="Name of the input file or files to be converted",
+        action="store",
+        nargs="+",
+        type=str,
+        dest="inputFiles",
+    )
+
+    parser.add_argument(
+        "-scaling",
+        "--scaling",
+        help="text file containing noise scaling factor; several files can be given "
+        "as <grating_filter>=<file>, plus an optional default <file>",
+        action="store",
+        nargs="+",
+        type=str,
+        default=None,
+        dest="scalingFactor",
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="number of parallel processes used to convert the spectra",
+        action="store",
+        type=int,
+        default=1,
+        dest="workers",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        help="convert the spectra with a read/convert/write pipeline, reading ahead "
+        "up to this number of spectra (useful on network filesystems)",
+        action="store",
+        type=int,
+        default=0,
+        dest="prefetch",
+    )
+
+    parser.add_argument(
+        "--stacked",
+        help="write all the spectra of the folder into a single stacked file",
+        action="store_true",
+        dest="stacked",
+    )
+
+    parser.add_argument(
+        "--float32",
+        help="store flux and error in single precision in the stacked file",
+        action="store_true",
+        dest="float32",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.logLevel)
+
+    if args.stacked:
+        convert_folder_stacked(
+            args.spectrumFolder,
+            inputFiles=args.inputFiles,
+            scalingFactor=args.scalingFactor,
+            workers=args.workers,
+            float32=args.float32,
+        )
+    else:
+        convert_folder(
+            args.spectrumFolder,
+            inputFiles=args.inputFiles,
+            scalingFactor=args.scalingFactor,
+            workers=args.workers,
+            prefetch=args.prefetch,
+        )
+
+
+if __name__ == "__main__":
+    main()
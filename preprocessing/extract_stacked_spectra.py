@@ -0,0 +1,53 @@
+import argparse
+import os
+import logging
+from convert_1D_to_Beagle_format import extract_stacked_spectrum
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract per-object Beagle-format spectra from a stacked file."
+    )
+
+    parser.add_argument(
+        "-f",
+        "--stacked-file",
+        help="stacked file produced by convert_1D_to_Beagle_format.py --stacked",
+        action="store",
+        type=str,
+        dest="stackedFile",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--IDs",
+        help="IDs of the objects to extract",
+        action="store",
+        nargs="+",
+        type=str,
+        dest="IDs",
+        required=True,
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        help="folder where the per-object files are written (default: the folder of the stacked file)",
+        action="store",
+        type=str,
+        dest="outputFolder",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    outputFolder = args.outputFolder or os.path.dirname(os.path.abspath(args.stackedFile))
+    os.makedirs(outputFolder, exist_ok=True)
+
+    for ID in args.IDs:
+        outputFile = os.path.join(outputFolder, ID + ".fits")
+        extract_stacked_spectrum(args.stackedFile, ID, outputFile)
+        logging.info(f"Extracted {ID} to {outputFile}")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,22 @@
 import os
-import subprocess
-from utils import run_command
+import logging
+from convert_1D_to_Beagle_format import convert_folder
 
-def scan_and_convert(input_folder):
+def scan_and_convert(input_folder, workers=1):
     # Iterate over all subdirectories of the given folder
     for root, dirs, files in os.walk(input_folder):
         # Check if any file in the directory ends with "_1D.fits"
         if any(file.endswith("_1D.fits") for file in files):
-            # Call the convert_files.py script with the sub-directory as an argument
-            command = ["python", "/mnt/globalNS/tmp/JADES/scripts/preprocessing/convert_1D_to_Beagle_format.py", "-s", root]
-            run_command(command)
+            # Convert the sub-directory in this interpreter, rather than launching
+            # a new Python process for each folder
+            convert_folder(root, workers=workers)
 
 if __name__ == "__main__":
     import sys
 
     # Check if the user provided an input folder
     if len(sys.argv) < 2:
-        print("Usage: python scan_and_convert.py <input_folder>")
+        print("Usage: python scan_and_convert.py <input_folder> [workers]")
         sys.exit(1)
 
     input_folder = sys.argv[1]
@@ -26,5 +26,8 @@ if __name__ == "__main__":
         print(f"Error: Folder '{input_folder}' does not exist.")
         sys.exit(1)
 
-    scan_and_convert(input_folder)
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
 
+    logging.basicConfig(level=logging.WARNING)
+
+    scan_and_convert(input_folder, workers=workers)
@@ -1,16 +1,28 @@
 import argparse
+import csv
+import json
 import os
+import time
 import shutil
 import glob
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # Add any missing imports here
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import numpy as np
 from astropy.io import fits
 import logging
+import spectra_inventory
 
 
 LOG_FILE = 'copy_log.txt'
 
+COPY_MODES = ['copy', 'hardlink', 'symlink', 'reflink']
+
+# ioctl request cloning a file on copy-on-write filesystems (Linux FICLONE)
+FICLONE = 0x40049409
+
 class CustomFormatter(logging.Formatter):
     newline_marker = 'NEWLINE'
 
@@ -40,22 +52,18 @@ def main() -> None:
     parser.add_argument('--IDs', 
                         nargs='+',
                         type=str,
-                        required=True,
                         help='List of IDs or file containing list of IDs')
     
     parser.add_argument('--parent-folder', 
                         type=str, 
-                        required=True,
                         help='Parent folder to search within')
     
     parser.add_argument('--output-folder', 
                         type=str,
-                        required=True,
                         help='Folder where files are copied to')
     
     parser.add_argument('--suffixes', 
                         nargs='+',
-                        required=True,
                         help='List of suffixes for file names')
     
     parser.add_argument('--log', 
@@ -63,10 +71,60 @@ def main() -> None:
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
 
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of threads used to read and score the candidate files, and to copy the '
+                             'selected ones, concurrently')
+
+    parser.add_argument('--mode',
+                        default='copy',
+                        choices=COPY_MODES,
+                        help='How the selected files are placed in the output folder. Links fall back to a copy '
+                             'when the filesystem does not support them')
+
+    parser.add_argument('--inventory',
+                        nargs='?',
+                        const='',
+                        default=None,
+                        help='Select the files from the spectrum inventory (see spectra_inventory.py) instead of '
+                             'scanning the parent folder and reading every candidate. Optionally, path to the '
+                             f'inventory file (default: {spectra_inventory.INVENTORY_FILE} in the parent folder). '
+                             f'File names not ending in {spectra_inventory.SPECTRUM_SUFFIX}, which are not in the '
+                             'inventory, are still searched for in the parent folder')
+
+    parser.add_argument('--no-refresh-inventory',
+                        action='store_false',
+                        dest='refresh_inventory',
+                        help='Use the spectrum inventory as it is, without first refreshing the spectra that were '
+                             'added, modified or removed since it was last updated')
+
+    parser.add_argument('--plan',
+                        type=str,
+                        default=None,
+                        help='Only plan the selection: write the candidates, their S/N, the chosen files and their '
+                             '2D companions to this manifest (.json, or .csv for review) without copying anything')
+
+    parser.add_argument('--execute',
+                        type=str,
+                        default=None,
+                        help='Apply a JSON selection manifest written with --plan, without rescanning or rescoring')
+
     
     args = parser.parse_args()
 
     _setup_logging(args.log)
+
+    if args.execute:
+        plan = _read_plan(args.execute)
+        output_folder = args.output_folder or plan['output_folder']
+        os.makedirs(output_folder, exist_ok=True)
+        _execute_plan(plan, output_folder, args.mode, args.jobs)
+        return
+
+    for option in ('IDs', 'parent_folder', 'output_folder', 'suffixes'):
+        if getattr(args, option) is None:
+            parser.error(f"--{option.replace('_', '-')} is required unless --execute is used")
     
     # Determine the list of IDs based on input method
     if len(args.IDs) == 1 and os.path.isfile(args.IDs[0]):
@@ -77,8 +135,23 @@ def main() -> None:
     # Ensure output folder exists
     os.makedirs(args.output_folder, exist_ok=True)
 
+    # Locate the spectrum inventory, if used
+    inventory_file = None
+    if args.inventory is not None:
+        inventory_file = args.inventory or spectra_inventory.default_inventory_file(args.parent_folder)
+        # The refresh only reopens the spectra that changed, so it is cheap on an up to date inventory
+        if args.refresh_inventory or not os.path.isfile(inventory_file):
+            spectra_inventory.refresh_inventory(inventory_file, args.parent_folder,
+                                                excluded_folder=args.output_folder)
+
+    if args.plan is not None:
+        plan = _plan_selection(args.parent_folder, ids, args.suffixes, args.output_folder, inventory_file, args.jobs)
+        _write_plan(plan, args.plan)
+        return
+
     # Search and copy files
-    _search_and_copy_files(args.parent_folder, ids, args.suffixes, args.output_folder)
+    _search_and_copy_files(args.parent_folder, ids, args.suffixes, args.output_folder, inventory_file, args.jobs,
+                           args.mode)
 
 def _setup_logging(level):
     """
@@ -124,74 +197,238 @@ def _get_ids_from_file(file: str) -> List[str]:
         # Split each line by whitespace and take the first element as the ID
         return [line.split()[0] for line in f.readlines() if not line.startswith('#')]
 
-def _compute_median_sn(fits_file: str) -> float:
+def _compute_median_sn(fits_file: str) -> Tuple[float, float]:
     """
-    Compute the median S/N from a FITS file.
+    Compute the median and peak S/N from a FITS file.
 
     Args:
         fits_file (str): Path to the FITS file.
 
     Returns:
-        float: The median S/N.
+        Tuple[float, float]: The median S/N and the peak S/N.
     """
-    # Open the FITS file
-    with fits.open(fits_file) as hdul:
+    # Open the FITS file, reading only the extensions needed
+    with fits.open(fits_file, memmap=True, lazy_load_hdus=True) as hdul:
         # Extract data and error arrays
         data: np.ndarray = hdul['DATA'].data  # type: ignore
         err: np.ndarray = hdul['ERR'].data  # type: ignore
 
-        # Compute the S/N
-        sn: np.ndarray = data[data > 0] / err[data > 0]
+        # Compute the S/N, using the same mask for the data and the error
+        positive = data > 0
+        sn: np.ndarray = data[positive] / err[positive]
 
         # Compute the median S/N
     return np.median(sn), np.max(sn)
 
-def _find_best_file(files: List[str]) -> str:
+def _score_files(files: List[str], jobs: int = 1) -> Iterator[Tuple[str, Optional[Tuple[float, float]], Optional[float]]]:
     """
-    Find the file with the highest median S/N among a list of files.
+    Compute the S/N score (geometric mean of the median and peak S/N) of a list of files.
+
+    With more than one job the files are read concurrently by a pool of threads, so
+    that slow file opens overlap, and the scores are yielded as soon as they are ready.
 
     Args:
         files (List[str]): List of file paths.
+        jobs (int): Number of threads.
 
-    Returns:
-        Optional[str]: The path to the file with the highest median S/N, or None if files is empty.
+    Yields:
+        Tuple[str, Optional[Tuple[float, float]], Optional[float]]: The path of a file, its median and peak S/N and
+            its score, or None if the file could not be processed.
     """
-    # Initialize variables to keep track of the best file and its S/N
-    best_file: Optional[str] = None
-    highest_sn: float = -np.inf
-    
-    # Loop over each file
-    for file in files:
-        # Log information
-        logging.info(f"NEWLINEProcessing file: {file}")
-
+    def score(file: str) -> Tuple[str, Optional[Tuple[float, float]], Optional[Exception]]:
         try:
-            # Compute the median S/N
-            sn, peak_sn = _compute_median_sn(file)
+            return file, _compute_median_sn(file), None
+        except Exception as e:
+            return file, None, e
+
+    if jobs > 1 and len(files) > 1:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        futures = [executor.submit(score, file) for file in files]
+        results = (future.result() for future in as_completed(futures))
+    else:
+        executor = None
+        results = map(score, files)
+
+    try:
+        for file, metrics, error in results:
+            # Log information
+            logging.info(f"NEWLINEProcessing file: {file}")
+
+            if error is not None:
+                # Print error message if there is an issue processing a file
+                print(f"Error processing {file}: {error}")
+                yield file, None, None
+                continue
+
+            sn, peak_sn = metrics
             logging.info(f"Median S/N: {sn}")
             logging.info(f"Peak S/N: {peak_sn}")
             sn = np.sqrt(sn*peak_sn)
             logging.info(f"Geometric mean median-peak S/N: {sn}")
-            
+            yield file, metrics, sn
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def _find_best_files(candidates: Dict[str, List[str]],
+                     jobs: int = 1,
+                     scores: Optional[Dict[str, Any]] = None) -> Dict[str, Optional[str]]:
+    """
+    Find, for each key, the file with the highest S/N among its candidate files.
+
+    The candidates of all the keys are scored together (see `_score_files`), each file
+    once, and every score is folded into the running best file of the keys it is a
+    candidate for as soon as it is available. Ties go to the earliest candidate, so
+    that the selection does not depend on the order in which the scores arrive.
+
+    Args:
+        candidates (Dict[str, List[str]]): Mapping from a key (e.g. a file name) to its candidate files.
+        jobs (int): Number of threads used to score the files.
+        scores (Optional[Dict[str, Any]]): If given, filled with the median S/N, peak S/N and score of each file.
+
+    Returns:
+        Dict[str, Optional[str]]: Mapping from each key to its best file, or None if it has no valid candidate.
+    """
+    keys_of_file: Dict[str, List[Tuple[str, int]]] = {}
+    for key, files in candidates.items():
+        for position, file in enumerate(files):
+            keys_of_file.setdefault(file, []).append((key, position))
+
+    best_files: Dict[str, Optional[str]] = {key: None for key in candidates}
+    highest_sn: Dict[str, Tuple[float, int]] = {key: (-np.inf, 0) for key in candidates}
+
+    for file, metrics, sn in _score_files(list(keys_of_file), jobs):
+        if scores is not None:
+            scores[file] = _score_record(metrics, sn)
+        if sn is None:
+            continue
+        for key, position in keys_of_file[file]:
             # If the current S/N is higher than the best one, update the best file
-            if sn > highest_sn:
-                highest_sn = sn
-                best_file = file
-        except Exception as e:
-            # Print error message if there is an issue processing a file
-            print(f"Error processing {file}: {e}")
-    
-    # Return the best file
+            if (sn, -position) > highest_sn[key]:
+                highest_sn[key] = (sn, -position)
+                best_files[key] = file
+
+    return best_files
+
+def _score_record(metrics: Optional[Tuple[float, float]], sn: Optional[float]) -> Dict[str, Optional[float]]:
+    if metrics is None:
+        return {'median_sn': None, 'peak_sn': None, 'score': None}
+    return {'median_sn': float(metrics[0]), 'peak_sn': float(metrics[1]), 'score': float(sn)}
+
+def _find_best_file_in_inventory(connection,
+                                 name: str,
+                                 parent_folder: str,
+                                 output_folder: str,
+                                 scores: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], List[str]]:
+    """
+    Find the file with the highest S/N among the files with a given name, using the
+    S/N metrics precomputed in the spectrum inventory.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the spectrum inventory.
+        name (str): The file name, which can contain glob wildcards.
+        parent_folder (str): The folder to search within.
+        output_folder (str): The folder where files are copied to, whose files are ignored.
+        scores (Optional[Dict[str, Any]]): If given, filled with the median S/N, peak S/N and score of each file.
+
+    Returns:
+        Tuple[Optional[str], List[str]]: The path to the file with the highest S/N, or None if no file is found,
+            and the paths of all the candidate files.
+    """
+    output_folder = os.path.normpath(os.path.abspath(output_folder))
+
+    best_file: Optional[str] = None
+    highest_sn: float = -np.inf
+    candidates: List[str] = []
+
+    for file, median_sn, peak_sn in spectra_inventory.find_spectra(connection, name, parent_folder):
+        file = os.path.abspath(file)
+        if file.startswith(output_folder + os.sep):
+            continue
+        candidates.append(file)
+
+        logging.info(f"NEWLINEProcessing file: {file}")
+
+        if median_sn is None or peak_sn is None:
+            print(f"Error processing {file}: no S/N in the inventory")
+            if scores is not None:
+                scores[file] = _score_record(None, None)
+            continue
+
+        logging.info(f"Median S/N: {median_sn}")
+        logging.info(f"Peak S/N: {peak_sn}")
+        sn = np.sqrt(median_sn*peak_sn)
+        logging.info(f"Geometric mean median-peak S/N: {sn}")
+        if scores is not None:
+            scores[file] = _score_record((median_sn, peak_sn), sn)
+
+        if sn > highest_sn:
+            highest_sn = sn
+            best_file = file
+
     logging.info(f"Best file: {best_file}")
-    return best_file
+    return best_file, candidates
+
+# Link modes that already fell back to a copy, to warn only once per mode
+_fallback_warnings = set()
+_fallback_lock = threading.Lock()
+
+def _warn_fallback(mode: str, error: Exception) -> None:
+    with _fallback_lock:
+        if mode not in _fallback_warnings:
+            _fallback_warnings.add(mode)
+            logging.warning(f"Cannot {mode} files in the output folder ({error}), copying them instead.")
+
+def _reflink(src: str, dst: str) -> None:
+    """
+    Clone src to dst on a copy-on-write filesystem (e.g. Btrfs, XFS), so that no data is duplicated.
+
+    Raises:
+        OSError: If the filesystem does not support cloning.
+    """
+    import fcntl
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def _is_up_to_date(src: str, dst: str, mode: str) -> bool:
+    """
+    Check whether dst already holds src for the given mode: same inode for hard links, same target for symbolic
+    links, and same size and modification time for copies. Hard links that fell back to a copy, because the
+    output folder is on another filesystem or the filesystem does not support them, are checked as copies.
+    """
+    if not os.path.lexists(dst):
+        return False
+
+    if os.path.islink(dst):
+        return mode == 'symlink' and os.readlink(dst) == os.path.abspath(src)
+
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if mode == 'hardlink':
+        if os.path.samestat(src_stat, dst_stat):
+            return True
+        with _fallback_lock:
+            fell_back = mode in _fallback_warnings
+        if not fell_back and src_stat.st_dev == dst_stat.st_dev:
+            return False
 
-def _copy_file_overwrite(src: str, dst: str) -> None:
+    return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+def _copy_file_overwrite(src: str, dst: str, mode: str = 'copy') -> None:
     """
-    Copy a file from src to dst. Overwrites the file at dst if it exists.
+    Copy a file from src to dst. Overwrites the file at dst if it exists, unless it already holds src.
 
     Args:
         src (str): Path to the source file.
         dst (str): Path to the destination file. Can be a directory, in which case the source file name is appended.
+        mode (str): One of COPY_MODES. Hard links, symbolic links and reflinks fall back to a copy when the
+            filesystem does not support them.
 
     Raises:
         OSError: If there is an error while removing an existing destination file.
@@ -201,9 +438,19 @@ def _copy_file_overwrite(src: str, dst: str) -> None:
     if os.path.isdir(dst):
         # Append the source file name to the destination directory if dst is a directory
         dst_ = os.path.join(dst, os.path.basename(src))
-        
+    else:
+        dst_ = dst
+
+    if not os.path.exists(src) and '_2D.fits' in src:
+        logging.warning(f"Source file {src} does not exist. Skipping copy of 2D file.")
+        return
+
+    if _is_up_to_date(src, dst_, mode):
+        logging.debug(f"Skipping {src}: {dst_} is up to date")
+        return
+
     # If the destination file exists, remove it (to allow overwriting)
-    if os.path.exists(dst_):
+    if os.path.lexists(dst_):
         # Remove the existing destination file
         try:
             os.remove(dst_)
@@ -211,28 +458,57 @@ def _copy_file_overwrite(src: str, dst: str) -> None:
             # Raise an exception if there is an error while removing the file
             raise OSError(f"Error while removing {dst_}: {e}")
 
-    if not os.path.exists(src) and '_2D.fits' in src:
-        logging.warning(f"Source file {src} does not exist. Skipping copy of 2D file.")
-        return
-    
     try:
-        shutil.copy2(src, dst)  # type: ignore
+        if mode == 'hardlink':
+            os.link(src, dst_)
+            return
+        if mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst_)
+            return
+        if mode == 'reflink':
+            _reflink(src, dst_)
+            return
+    except OSError as e:
+        _warn_fallback(mode, e)
+
+    try:
+        shutil.copy2(src, dst_)  # type: ignore
     except Exception as e:
         # Raise an exception if there is an error while copying the file
         raise Exception(f"Error while copying {src} to {dst}: {e}")
-    
 
-def _log_copy(src: str, dst: str) -> None:
+def _copy_files(files: List[str], output_folder: str, mode: str = 'copy', jobs: int = 1) -> None:
     """
-    Log the copy of a file by writing the source and destination paths to a file named 'copy_log.txt' in the destination directory.
-    If the log file already exists, it is removed before writing.
+    Copy the selected files, and the 2D companions of the 1D spectra, to the output folder, using a bounded pool of
+    threads.
 
     Args:
-        src (str): Path to the source file.
-        dst (str): Path to the destination directory.
+        files (List[str]): Paths of the selected files.
+        output_folder (str): The folder where files are copied to.
+        mode (str): One of COPY_MODES.
+        jobs (int): Number of threads.
+    """
+    # One copy per destination: if two sources share a file name, the last one wins
+    sources: Dict[str, str] = {}
+    for file in files:
+        sources[os.path.basename(file)] = file
+        if "_1D.fits" in file:
+            file_2d = file.replace("_1D.fits", "_2D.fits")
+            sources[os.path.basename(file_2d)] = file_2d
 
-    Raises:
-        OSError: If there is an error while removing the existing log file.
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(_copy_file_overwrite, src, output_folder, mode) for src in sources.values()]
+        for future in futures:
+            future.result()
+
+def _log_copies(files: List[str], dst: str) -> None:
+    """
+    Log the copy of files by writing the source and destination paths to a file named 'copy_log.txt' in the
+    destination directory, in a single write.
+
+    Args:
+        files (List[str]): Paths to the source files.
+        dst (str): Path to the destination directory.
 
     """
     # Construct the path to the log file
@@ -241,48 +517,241 @@ def _log_copy(src: str, dst: str) -> None:
     # Open the log file in append mode
     with open(log_file_path, 'a') as log_file:
         # Write the source and destination paths to the log file
-        log_file.write(f"{src} --> {os.path.join(dst, os.path.basename(src))}\n")
+        log_file.writelines(f"{src} --> {os.path.join(dst, os.path.basename(src))}\n" for src in files)
 
-def _search_and_copy_files(parent_folder: str, ids: List[str], suffixes: List[str], output_folder: str) -> None:
+def _build_file_index(parent_folder: str, excluded_folder: str) -> Dict[str, List[str]]:
     """
-    Search for files in the parent folder with given IDs and suffixes, and copy them to the output folder.
+    Walk the parent folder once and index all the files it contains by name.
+
+    Hidden files and folders are ignored (as with a recursive glob), and the excluded
+    folder (e.g. the output folder) is not descended into.
+
+    Args:
+        parent_folder (str): The folder to search within.
+        excluded_folder (str): Folder to skip while walking the parent folder.
+
+    Returns:
+        Dict[str, List[str]]: Mapping from each file name to the sorted list of paths where it was found.
+    """
+    excluded_folder = os.path.normpath(os.path.abspath(excluded_folder))
+
+    index: Dict[str, List[str]] = {}
+    folders = [parent_folder]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        if os.path.normpath(os.path.abspath(entry.path)) != excluded_folder:
+                            folders.append(entry.path)
+                    else:
+                        index.setdefault(entry.name, []).append(entry.path)
+        except OSError as e:
+            logging.warning(f"Cannot scan {folder}: {e}")
+
+    for paths in index.values():
+        paths.sort()
+
+    logging.info(f"Indexed {sum(map(len, index.values()))} files in {parent_folder}")
+    return index
+
+def _find_files(index: Dict[str, List[str]], name: str) -> List[str]:
+    """
+    Look up the files with a given name in the index built by `_build_file_index`.
+
+    Args:
+        index (Dict[str, List[str]]): The file index.
+        name (str): The file name, which can contain glob wildcards.
+
+    Returns:
+        List[str]: List of matching paths.
+    """
+    if not glob.has_magic(name):
+        return index.get(name, [])
+
+    return sorted(path for key in fnmatch.filter(index, name) for path in index[key])
+
+def _plan_selection(parent_folder: str,
+                    ids: List[str],
+                    suffixes: List[str],
+                    output_folder: str,
+                    inventory_file: Optional[str] = None,
+                    jobs: int = 1) -> Dict[str, Any]:
+    """
+    Search for files in the parent folder with given IDs and suffixes, score them and choose the best one for each
+    ID and suffix, without copying anything.
     If no file is found for a given ID, a warning is printed.
 
     Args:
         parent_folder (str): The folder to search within.
         ids (List[str]): List of IDs to search for.
         suffixes (List[str]): List of suffixes to append to the IDs.
-        output_folder (str): The folder where files are copied to.
-    """
-    output_folder_normalized = os.path.normpath(output_folder)
+        output_folder (str): The folder where files will be copied to, which is not searched.
+        inventory_file (Optional[str]): If given, the spectrum inventory used to find and rank the 1D spectra.
+        jobs (int): Number of threads used to score the candidate files.
 
+    Returns:
+        Dict[str, Any]: The selection plan, listing for each ID and suffix the candidates with their S/N, the chosen
+            file and its 2D companion, together with the time spent in each phase.
+    """
+    timings: Dict[str, float] = {}
+
+    # Record absolute paths, so that the plan can be executed from any folder
+    parent_folder = os.path.abspath(parent_folder)
+    output_folder = os.path.abspath(output_folder)
+
+    # If id_ has a length of less than 6 characetrs, add 0's to the front to reach 6 characters
+    ids = ['0'*(6-len(id_)) + id_ if len(id_) < 6 else id_ for id_ in ids]
+    names = [id_ + suffix for id_ in ids for suffix in suffixes]
+
+    scores: Dict[str, Any] = {}
+    best_files: Dict[str, Optional[str]] = {}
+    candidates: Dict[str, List[str]] = {}
+
+    # The inventory only indexes the 1D spectra: other names (e.g. 2D spectra) are
+    # searched for in the parent folder
+    scanned_names = names
+    if inventory_file is not None:
+        inventory_names = [name for name in names if name.endswith(spectra_inventory.SPECTRUM_SUFFIX)]
+        scanned_names = [name for name in names if not name.endswith(spectra_inventory.SPECTRUM_SUFFIX)]
+
+        start = time.perf_counter()
+        connection = spectra_inventory.connect(inventory_file)
+        for name in inventory_names:
+            best_files[name], candidates[name] = _find_best_file_in_inventory(connection, name, parent_folder,
+                                                                              output_folder, scores)
+        connection.close()
+        timings['inventory_query'] = time.perf_counter() - start
+
+    if scanned_names:
+        # Scan the parent folder once, rather than once per ID and suffix
+        start = time.perf_counter()
+        index = _build_file_index(parent_folder, output_folder)
+        scanned = {name: _find_files(index, name) for name in scanned_names}
+        candidates.update(scanned)
+        timings['scan'] = time.perf_counter() - start
+
+        # Score the candidates of all the IDs and suffixes together
+        start = time.perf_counter()
+        best_files.update(_find_best_files(scanned, jobs, scores))
+        timings['scoring'] = time.perf_counter() - start
+
+    selections = []
     for id_ in ids:
-        # If id_ has a length of less than 6 characetrs, add 0's to the front to reach 6 characters
-        if len(id_) < 6:
-            id_ = '0'*(6-len(id_)) + id_
-              
         # Flag to keep track if a file was found for a given ID
         found = False
         
         # Iterate over suffixes
         for suffix in suffixes:
-            # Construct the pattern to search for
-            pattern = os.path.join(parent_folder, "**", id_ + suffix)
-            matching_files = glob.glob(pattern, recursive=True)
-            matching_files = [f for f in matching_files if not f.startswith(output_folder_normalized)]
-
-            best_file = _find_best_file(matching_files)
+            best_file = best_files[id_ + suffix]
+            logging.info(f"Best file for {id_ + suffix}: {best_file}")
+            best_file_2d = None
+            if best_file and "_1D.fits" in best_file:
+                best_file_2d = best_file.replace("_1D.fits", "_2D.fits")
+            selections.append({
+                'ID': id_,
+                'suffix': suffix,
+                'candidates': [dict(path=file, **scores.get(file, _score_record(None, None)))
+                               for file in candidates[id_ + suffix]],
+                'chosen': best_file,
+                'companion_2d': best_file_2d,
+            })
             if best_file:
-                _copy_file_overwrite(best_file, output_folder)
-                if "_1D.fits" in best_file:
-                    best_file_2d = best_file.replace("_1D.fits", "_2D.fits")
-                    _copy_file_overwrite(best_file_2d, output_folder)
-                _log_copy(best_file, output_folder)
                 found = True
         
         # If no file was found for a given ID, print a warning
         if not found:
             print(f'Warning: No file found for ID {id_} with any of the provided suffixes.')
 
+    return {
+        'parent_folder': parent_folder,
+        'output_folder': output_folder,
+        'inventory': inventory_file,
+        'timings': timings,
+        'selections': selections,
+    }
+
+def _write_plan(plan: Dict[str, Any], plan_file: str) -> None:
+    """
+    Write a selection plan to a JSON manifest or, if the file name ends with '.csv', to a CSV table with one row
+    per candidate.
+
+    Args:
+        plan (Dict[str, Any]): The selection plan built by `_plan_selection`.
+        plan_file (str): Path to the manifest.
+    """
+    if plan_file.endswith('.csv'):
+        with open(plan_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ID', 'suffix', 'path', 'median_sn', 'peak_sn', 'score', 'chosen', 'companion_2d'])
+            for selection in plan['selections']:
+                for candidate in selection['candidates']:
+                    chosen = candidate['path'] == selection['chosen']
+                    writer.writerow([selection['ID'], selection['suffix'], candidate['path'], candidate['median_sn'],
+                                     candidate['peak_sn'], candidate['score'], chosen,
+                                     selection['companion_2d'] if chosen else ''])
+    else:
+        with open(plan_file, 'w') as f:
+            json.dump(plan, f, indent=2)
+
+    logging.info(f"Selection plan written to {plan_file} (timings: {plan['timings']})")
+
+def _read_plan(plan_file: str) -> Dict[str, Any]:
+    """
+    Read a JSON selection manifest written by `_write_plan`.
+
+    Args:
+        plan_file (str): Path to the manifest.
+
+    Returns:
+        Dict[str, Any]: The selection plan.
+    """
+    with open(plan_file, 'r') as f:
+        return json.load(f)
+
+def _execute_plan(plan: Dict[str, Any], output_folder: str, mode: str = 'copy', jobs: int = 1) -> None:
+    """
+    Apply a selection plan: copy all the chosen files and their 2D companions to the output folder in one batched
+    pass, and log the copies with a single write.
+
+    Args:
+        plan (Dict[str, Any]): The selection plan built by `_plan_selection`.
+        output_folder (str): The folder where files are copied to.
+        mode (str): How the selected files are placed in the output folder, one of COPY_MODES.
+        jobs (int): Number of threads used to copy the files.
+    """
+    selected = [selection['chosen'] for selection in plan['selections'] if selection['chosen']]
+
+    start = time.perf_counter()
+    _copy_files(selected, output_folder, mode, jobs)
+    _log_copies(selected, output_folder)
+    logging.info(f"Copied {len(selected)} selected files to {output_folder} in {time.perf_counter() - start:.2f} s")
+
+def _search_and_copy_files(parent_folder: str,
+                           ids: List[str],
+                           suffixes: List[str],
+                           output_folder: str,
+                           inventory_file: Optional[str] = None,
+                           jobs: int = 1,
+                           mode: str = 'copy') -> None:
+    """
+    Search for files in the parent folder with given IDs and suffixes, and copy them to the output folder.
+    If no file is found for a given ID, a warning is printed.
+
+    Args:
+        parent_folder (str): The folder to search within.
+        ids (List[str]): List of IDs to search for.
+        suffixes (List[str]): List of suffixes to append to the IDs.
+        output_folder (str): The folder where files are copied to.
+        inventory_file (Optional[str]): If given, the spectrum inventory used to find and rank the files.
+        jobs (int): Number of threads used to score the candidate files and to copy the selected ones.
+        mode (str): How the selected files are placed in the output folder, one of COPY_MODES.
+    """
+    plan = _plan_selection(parent_folder, ids, suffixes, output_folder, inventory_file, jobs)
+    _execute_plan(plan, output_folder, mode, jobs)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,261 @@
+import argparse
+import logging
+import os
+import re
+import sqlite3
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from astropy.io import fits
+
+
+INVENTORY_FILE = 'spectra_inventory.sqlite'
+
+SPECTRUM_SUFFIX = '_1D.fits'
+
+# e.g. 001210_prism_clear_v3.0_1D.fits
+NAME_PATTERN = re.compile(r'^(?P<id>[^_]+)_(?P<grating_filter>[^_]+_[^_]+)_(?P<version>v[^_]+)_1D\.fits$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS spectra (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    id TEXT,
+    grating_filter TEXT,
+    version TEXT,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    median_sn REAL,
+    peak_sn REAL,
+    masked_fraction REAL
+);
+CREATE INDEX IF NOT EXISTS spectra_name ON spectra (name);
+CREATE INDEX IF NOT EXISTS spectra_id ON spectra (id, grating_filter);
+'''
+
+def default_inventory_file(parent_folder: str) -> str:
+    """
+    Default location of the inventory of a reduction tree, at the top of the tree.
+
+    Args:
+        parent_folder (str): Root folder of the reduction tree.
+
+    Returns:
+        str: Path to the inventory file.
+    """
+    return os.path.join(parent_folder, INVENTORY_FILE)
+
+def connect(inventory_file: str) -> sqlite3.Connection:
+    """
+    Open (and create, if needed) a spectrum inventory.
+
+    Args:
+        inventory_file (str): Path to the SQLite inventory file.
+
+    Returns:
+        sqlite3.Connection: Connection to the inventory.
+    """
+    connection = sqlite3.connect(inventory_file)
+    connection.executescript(SCHEMA)
+    return connection
+
+def compute_sn_metrics(fits_file: str) -> Tuple[float, float, float]:
+    """
+    Compute the median and peak S/N and the fraction of masked pixels of a 1D spectrum.
+
+    The S/N is computed over the pixels with positive flux, and masked pixels are the
+    ones with a non-finite flux.
+
+    Args:
+        fits_file (str): Path to the FITS file.
+
+    Returns:
+        Tuple[float, float, float]: The median S/N, the peak S/N and the masked-pixel fraction.
+    """
+    with fits.open(fits_file, memmap=True, lazy_load_hdus=True) as hdul:
+        data: np.ndarray = hdul['DATA'].data  # type: ignore
+        err: np.ndarray = hdul['ERR'].data  # type: ignore
+
+        masked_fraction = float(np.mean(~np.isfinite(data))) if len(data) else np.nan
+
+        positive = data > 0
+        if not positive.any():
+            return np.nan, np.nan, masked_fraction
+
+        sn: np.ndarray = data[positive] / err[positive]
+
+    return float(np.median(sn)), float(np.max(sn)), masked_fraction
+
+def _compute_row(path: str) -> Tuple[str, Optional[Tuple[float, float, float]]]:
+    try:
+        return path, compute_sn_metrics(path)
+    except Exception as e:
+        logging.warning(f"Error processing {path}: {e}")
+        return path, None
+
+def _scan_spectra(parent_folder: str, excluded_folder: Optional[str] = None) -> Dict[str, os.stat_result]:
+    """
+    Walk the reduction tree once and stat all the 1D spectra it contains.
+
+    Args:
+        parent_folder (str): Root folder of the reduction tree.
+        excluded_folder (Optional[str]): Folder not to descend into (e.g. a selection output folder).
+
+    Returns:
+        Dict[str, os.stat_result]: Mapping from the absolute path of each 1D spectrum to its stat.
+    """
+    parent_folder = os.path.abspath(parent_folder)
+    if excluded_folder is not None:
+        excluded_folder = os.path.normpath(os.path.abspath(excluded_folder))
+
+    stats: Dict[str, os.stat_result] = {}
+    folders = [parent_folder]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        if os.path.normpath(os.path.abspath(entry.path)) != excluded_folder:
+                            folders.append(entry.path)
+                    elif entry.name.endswith(SPECTRUM_SUFFIX):
+                        stats[entry.path] = entry.stat()
+        except OSError as e:
+            logging.warning(f"Cannot scan {folder}: {e}")
+
+    return stats
+
+def _folder_prefix(folder: str) -> str:
+    return os.path.join(os.path.abspath(folder), '')
+
+def refresh_inventory(inventory_file: str,
+                      parent_folder: str,
+                      processes: Optional[int] = None,
+                      excluded_folder: Optional[str] = None) -> Tuple[int, int, int]:
+    """
+    Bring the inventory up to date with the reduction tree.
+
+    Only the spectra that are new, or whose size or modification time changed, are
+    opened to recompute their S/N metrics (in parallel), and the rows of spectra of the
+    tree that no longer exist are removed. Paths are stored as absolute paths, so the
+    same inventory can be refreshed and queried from any working directory, and can be
+    shared between several trees.
+
+    Args:
+        inventory_file (str): Path to the SQLite inventory file.
+        parent_folder (str): Root folder of the reduction tree.
+        processes (Optional[int]): Number of parallel processes (default: number of CPUs).
+        excluded_folder (Optional[str]): Folder not to descend into.
+
+    Returns:
+        Tuple[int, int, int]: Number of added or updated, unchanged and removed spectra.
+    """
+    stats = _scan_spectra(parent_folder, excluded_folder)
+
+    with connect(inventory_file) as connection:
+        # Rows with relative paths come from older inventories, and are replaced with
+        # their absolute paths
+        connection.execute("DELETE FROM spectra WHERE substr(path, 1, 1) != '/'")
+
+        prefix = _folder_prefix(parent_folder)
+        known = {path: (size, mtime) for path, size, mtime in
+                 connection.execute('SELECT path, size, mtime FROM spectra WHERE substr(path, 1, ?) = ?',
+                                    (len(prefix), prefix))}
+
+        changed = [path for path, stat in stats.items()
+                   if known.get(path) != (stat.st_size, stat.st_mtime_ns)]
+        removed = [path for path in known if path not in stats]
+
+        logging.info(f"Inventory: {len(changed)} new or changed, {len(removed)} removed spectra")
+
+        if changed:
+            with Pool(processes) as pool:
+                results = pool.map(_compute_row, changed, chunksize=16)
+        else:
+            results = []
+
+        rows = []
+        for path, metrics in results:
+            name = os.path.basename(path)
+            match = NAME_PATTERN.match(name)
+            median_sn, peak_sn, masked_fraction = metrics if metrics is not None else (None, None, None)
+            rows.append((path,
+                         name,
+                         match['id'] if match else None,
+                         match['grating_filter'] if match else None,
+                         match['version'] if match else None,
+                         stats[path].st_size,
+                         stats[path].st_mtime_ns,
+                         median_sn,
+                         peak_sn,
+                         masked_fraction))
+
+        connection.executemany('INSERT OR REPLACE INTO spectra VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        connection.executemany('DELETE FROM spectra WHERE path = ?', [(path,) for path in removed])
+
+    connection.close()
+
+    return len(changed), len(stats) - len(changed), len(removed)
+
+def find_spectra(connection: sqlite3.Connection,
+                 name: str,
+                 parent_folder: Optional[str] = None) -> List[Tuple[str, Optional[float], Optional[float]]]:
+    """
+    Look up the spectra with a given file name in the inventory.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the inventory.
+        name (str): The file name, which can contain glob wildcards.
+        parent_folder (Optional[str]): If given, only the spectra within this folder are returned.
+
+    Returns:
+        List[Tuple[str, Optional[float], Optional[float]]]: Path, median S/N and peak S/N of each spectrum.
+    """
+    if parent_folder is None:
+        return connection.execute('SELECT path, median_sn, peak_sn FROM spectra WHERE name GLOB ? ORDER BY path',
+                                  (name,)).fetchall()
+
+    prefix = _folder_prefix(parent_folder)
+    return connection.execute('SELECT path, median_sn, peak_sn FROM spectra '
+                              'WHERE name GLOB ? AND substr(path, 1, ?) = ? ORDER BY path',
+                              (name, len(prefix), prefix)).fetchall()
+
+def main() -> None:
+    """
+    Build or refresh the spectrum inventory of a reduction tree.
+    """
+    parser = argparse.ArgumentParser(description='Build or refresh the inventory of the 1D spectra of a reduction tree.')
+
+    parser.add_argument('--parent-folder',
+                        type=str,
+                        required=True,
+                        help='Root folder of the reduction tree')
+
+    parser.add_argument('--inventory',
+                        type=str,
+                        default=None,
+                        help=f'Inventory file (default: {INVENTORY_FILE} in the parent folder)')
+
+    parser.add_argument('-np',
+                        type=int,
+                        default=None,
+                        dest='processes',
+                        help='Number of parallel processes')
+
+    parser.add_argument('--log',
+                        default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log, format='%(levelname)s: %(message)s')
+
+    inventory_file = args.inventory or default_inventory_file(args.parent_folder)
+    updated, unchanged, removed = refresh_inventory(inventory_file, args.parent_folder, args.processes)
+    logging.info(f"{inventory_file}: {updated} added or updated, {unchanged} unchanged, {removed} removed")
+
+if __name__ == '__main__':
+    main()